@@ -1,5 +1,3 @@
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from django.apps import AppConfig
 
 
@@ -8,12 +6,4 @@ class ServerConfig(AppConfig):
     name = 'Server'
 
     def ready(self):
-        from Server.utils.file_cleaner import main
-
-        def start_loop(loop):
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(main())
-
-        executor = ThreadPoolExecutor()
-        loop = asyncio.new_event_loop()
-        executor.submit(start_loop, loop)
+        import Server.signals  # noqa: F401
@@ -0,0 +1,21 @@
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from Server.settings import SQLITE_PRAGMAS
+
+
+class DatabaseWrapper(SQLiteDatabaseWrapper):
+    """
+    SQLite backend tuned for concurrent requests of a single node.
+    Every new connection is configured with SQLITE_PRAGMAS, e.g. switched to WAL mode.
+    Transactions take the write lock when they begin. A deferred transaction that reads before it writes
+    fails with 'database is locked' without waiting, if another connection wrote in the meantime,
+    an immediate one waits for the lock up to the busy timeout instead.
+    """
+
+    def get_new_connection(self, conn_params: dict):
+        connection = super().get_new_connection(conn_params)
+        for pragma, value in SQLITE_PRAGMAS.items():
+            connection.execute(f'PRAGMA {pragma} = {value}')
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,341 @@
+import os
+import uuid
+import zlib
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+from typing import Iterable, Iterator
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File as DjangoFile
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils.deconstruct import deconstructible
+from Server.settings import FILE_STREAM_BLOCK_SIZE, STORAGE_LISTING_WORKERS
+
+# Pool walking directory trees in parallel, os.scandir releases the GIL while it reads a directory
+listing_executor = ThreadPoolExecutor(max_workers=STORAGE_LISTING_WORKERS, thread_name_prefix='storage-listing')
+# Levels of the trees read before the subtrees below them are walked in parallel. The levels are read until
+# there are enough subtrees to keep the workers busy, e.g. down to uploads/blobs/<aa> for a listing of uploads.
+LISTING_SPLIT_DEPTH = 3
+LISTING_SPLIT_SUBTREES = 4 * STORAGE_LISTING_WORKERS
+
+
+def scan_directory(path: str, name: str) -> tuple[list[str], list[tuple[str, str]]]:
+    """
+    Read one directory with os.scandir, which reads the type of the entries together with their names,
+    so no file is stat'ed.
+    :param path: path to the directory
+    :param name: name of the directory in the storage
+    :return: tuple containing the names of the files and the paths and names of the subdirectories,
+             both empty if the directory does not exist
+    """
+    names, directories = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                entry_name = f'{name}/{entry.name}' if name else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append((entry.path, entry_name))
+                elif entry.is_file(follow_symlinks=False):
+                    names.append(entry_name)
+    except FileNotFoundError:
+        pass
+    return names, directories
+
+
+def walk_tree(path: str, name: str) -> list[str]:
+    """
+    Walk the directory tree.
+    :param path: path to the root of the tree
+    :param name: name of the root in the storage
+    :return: list of the names of the files in the tree
+    """
+    names = []
+    directories = [(path, name)]
+    while directories:
+        directory_names, subdirectories = scan_directory(*directories.pop())
+        names.extend(directory_names)
+        directories.extend(subdirectories)
+    return names
+
+
+def iter_trees(roots: list[tuple[str, str]]) -> Iterator[str]:
+    """
+    List the files of the directory trees. The top levels of the trees are read level by level, every level
+    in parallel, until there are LISTING_SPLIT_SUBTREES subtrees or LISTING_SPLIT_DEPTH levels were read.
+    The subtrees are then walked in parallel on the listing executor, the names are produced as they are done.
+    :param roots: list of tuples containing the path to the root of a tree and its name in the storage
+    :return: iterator over the names of the files
+    """
+    directories = list(roots)
+    for _ in range(LISTING_SPLIT_DEPTH):
+        if not directories or len(directories) >= LISTING_SPLIT_SUBTREES:
+            break
+        subdirectories = []
+        for names, directory_subdirectories in listing_executor.map(lambda root: scan_directory(*root), directories):
+            yield from names
+            subdirectories.extend(directory_subdirectories)
+        directories = subdirectories
+
+    subtrees = [listing_executor.submit(walk_tree, path, name) for path, name in directories]
+    try:
+        for subtree in as_completed(subtrees):
+            yield from subtree.result()
+    finally:
+        for subtree in subtrees:
+            subtree.cancel()
+
+
+class StagedFile(DjangoFile):
+    """
+    Content staged next to the name it is going to be written under, see StorageBackend.stage.
+    Writing it under that name moves it into place. The staged file is removed when it is closed, unless it was moved.
+    """
+
+    def __init__(self, path: str, name: str):
+        super().__init__(open(path, 'rb'), name)
+        self.path = path
+
+    def temporary_file_path(self) -> str:
+        return self.path
+
+    def close(self) -> None:
+        super().close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class StorageBackend(Storage):
+    """
+    Storage of the uploaded files. Besides the operations of a Django storage, files are written under
+    an exact name, staged next to that name, removed in bulk and listed recursively. Opened files are seekable,
+    ranged reads seek to the start of the range instead of reading the file from the beginning.
+    """
+
+    def write(self, name: str, content: DjangoFile) -> None:
+        """
+        Store the content under exactly the given name, replacing an existing file.
+        A file is never visible half written.
+        :param name: name of the file in the storage
+        :param content: file with the content
+        :return: None
+        """
+        raise NotImplementedError('subclasses of StorageBackend must provide a write() method')
+
+    def stage(self, name: str, content: DjangoFile) -> StagedFile:
+        """
+        Store a copy of the content next to the given name, e.g. before a transaction the content is written in,
+        so that writing the staged file under the name later only moves it into place. The content is kept.
+        :param name: name of the file in the storage the content is going to be written under
+        :param content: file with the content
+        :return: StagedFile to write under the name, to be closed once it is no longer needed
+        """
+        raise NotImplementedError('subclasses of StorageBackend must provide a stage() method')
+
+    def remove(self, name: str) -> bool:
+        """
+        Delete the file if it exists.
+        :param name: name of the file in the storage
+        :return: True if the file was deleted, False if it did not exist
+        """
+        raise NotImplementedError('subclasses of StorageBackend must provide a remove() method')
+
+    def delete_many(self, names: Iterable[str], executor: Executor = None) -> int:
+        """
+        Delete the files that exist among the given ones, concurrently if an executor is given.
+        :param names: names of the files in the storage
+        :param executor: executor the deletions are run on
+        :return: number of deleted files
+        """
+        return sum(executor.map(self.remove, names) if executor else map(self.remove, names))
+
+    def copy(self, name: str, new_name: str) -> None:
+        """
+        Store the content of the file under another name as well, replacing an existing file.
+        The copy is modified at the time it is made, not at the time of the original.
+        :param name: name of the file in the storage
+        :param new_name: name of the copy
+        :return: None
+        """
+        with self.open(name) as content:
+            self.write(new_name, content)
+
+    def iter_files(self, prefix: str = '') -> Iterator[str]:
+        """
+        List the names of all files under the prefix, including those in nested directories.
+        The order of the names is not defined.
+        :param prefix: name of the directory to list
+        :return: iterator over the names of the files
+        """
+        raise NotImplementedError('subclasses of StorageBackend must provide an iter_files() method')
+
+
+class LocalStorage(StorageBackend, FileSystemStorage):
+    """
+    Files kept in one directory on the local disk, MEDIA_ROOT by default.
+    """
+
+    def write(self, name: str, content: DjangoFile) -> None:
+        """
+        Temporary files are moved into place, other files are copied chunk by chunk into a temporary file
+        next to the destination first.
+        """
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if hasattr(content, 'temporary_file_path'):
+            file_move_safe(content.temporary_file_path(), path, allow_overwrite=True)
+            return
+        temporary_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temporary_path, 'wb') as f:
+                for chunk in content.chunks(FILE_STREAM_BLOCK_SIZE):
+                    f.write(chunk)
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def stage(self, name: str, content: DjangoFile) -> StagedFile:
+        """
+        The staged file is kept in the directory of the file, on the same file system. Temporary files are
+        hard linked where the file system supports it, nothing is copied. The staged file is touched,
+        so the cleaner does not take it for an orphan older than its grace period.
+        """
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staged_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            try:
+                os.link(content.temporary_file_path(), staged_path)
+            except (AttributeError, OSError):
+                with open(staged_path, 'wb') as f:
+                    for chunk in content.chunks(FILE_STREAM_BLOCK_SIZE):
+                        f.write(chunk)
+            os.utime(staged_path)
+            return StagedFile(staged_path, content.name)
+        except BaseException:
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+            raise
+
+    def remove(self, name: str) -> bool:
+        try:
+            os.remove(self.path(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def copy(self, name: str, new_name: str) -> None:
+        """
+        The copy is a hard link to the same content where the file system supports it, nothing is copied.
+        The link is touched, so the copy counts as a new file, e.g. for the grace period of the cleaner.
+        """
+        path = self.path(name)
+        new_path = self.path(new_name)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        temporary_path = f'{new_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.link(path, temporary_path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            super().copy(name, new_name)
+            return
+        os.utime(temporary_path)
+        os.replace(temporary_path, new_path)
+
+    def iter_files(self, prefix: str = '') -> Iterator[str]:
+        """
+        The subdirectories of the prefix are walked in parallel.
+        """
+        return iter_trees([(self.path(prefix), prefix.strip('/'))])
+
+
+@deconstructible
+class ShardedStorage(StorageBackend):
+    """
+    Files spread over several directories, e.g. one per disk, so the storage is not limited to one disk.
+    Every file is kept in the directory selected by a hash of its name, which needs no lookup table.
+    The list of directories must not be changed once files are stored, their names would map to other directories.
+    """
+
+    def __init__(self, locations: list[str] = None, **kwargs):
+        if not locations:
+            raise ImproperlyConfigured('ShardedStorage requires at least one location, set STORAGE_SHARDS')
+        self.shards = [LocalStorage(location=location, **kwargs) for location in locations]
+
+    def get_shard(self, name: str) -> LocalStorage:
+        """
+        Get the storage of the directory the file with the given name is kept in.
+        :param name: name of the file in the storage
+        :return: LocalStorage of the directory
+        """
+        return self.shards[zlib.crc32(name.encode()) % len(self.shards)]
+
+    def _open(self, name: str, mode: str = 'rb') -> DjangoFile:
+        return self.get_shard(name)._open(name, mode)
+
+    def _save(self, name: str, content: DjangoFile) -> str:
+        return self.get_shard(name)._save(name, content)
+
+    def write(self, name: str, content: DjangoFile) -> None:
+        self.get_shard(name).write(name, content)
+
+    def stage(self, name: str, content: DjangoFile) -> StagedFile:
+        return self.get_shard(name).stage(name, content)
+
+    def remove(self, name: str) -> bool:
+        return self.get_shard(name).remove(name)
+
+    def delete(self, name: str) -> None:
+        self.get_shard(name).delete(name)
+
+    def exists(self, name: str) -> bool:
+        return self.get_shard(name).exists(name)
+
+    def path(self, name: str) -> str:
+        return self.get_shard(name).path(name)
+
+    def size(self, name: str) -> int:
+        return self.get_shard(name).size(name)
+
+    def url(self, name: str) -> str:
+        return self.get_shard(name).url(name)
+
+    def get_accessed_time(self, name: str):
+        return self.get_shard(name).get_accessed_time(name)
+
+    def get_created_time(self, name: str):
+        return self.get_shard(name).get_created_time(name)
+
+    def get_modified_time(self, name: str):
+        return self.get_shard(name).get_modified_time(name)
+
+    def listdir(self, path: str) -> tuple[list[str], list[str]]:
+        """
+        Directories are merged, every directory may have entries in every shard.
+        """
+        directories, files = set(), set()
+        for shard in self.shards:
+            try:
+                shard_directories, shard_files = shard.listdir(path)
+            except FileNotFoundError:
+                continue
+            directories.update(shard_directories)
+            files.update(shard_files)
+        if not directories and not files and not any(shard.exists(path) for shard in self.shards):
+            raise FileNotFoundError(f'No such directory: {path}')
+        return sorted(directories), sorted(files)
+
+    def copy(self, name: str, new_name: str) -> None:
+        shard = self.get_shard(name)
+        if shard is self.get_shard(new_name):
+            shard.copy(name, new_name)
+        else:
+            super().copy(name, new_name)
+
+    def iter_files(self, prefix: str = '') -> Iterator[str]:
+        """
+        The subdirectories of the prefix in all shards are walked in parallel.
+        """
+        return iter_trees([(shard.path(prefix), prefix.strip('/')) for shard in self.shards])
@@ -0,0 +1,56 @@
+from collections import Counter
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Server.models.file_model import File
+from Server.utils.blob_store import inspect_file
+from Server.utils.usage import adjust_usage
+
+
+class Command(BaseCommand):
+    help = ('Record filename, size, SHA-256 and MIME type of files uploaded before they were recorded at upload time. '
+            'The recorded sizes are counted towards the usage of the owners of the files.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of files updated per query')
+
+    def handle(self, *args, **options):
+        batch = []
+        updated = 0
+        for file in File.objects.filter(size__isnull=True).iterator(chunk_size=options['batch_size']):
+            file.filename = file.get_original_filename()
+            try:
+                with default_storage.open(file.file.name) as source:
+                    file.sha256, file.mime_type = inspect_file(source, file.get_original_filename())
+                    file.size = source.size
+            except FileNotFoundError:
+                self.stderr.write(f'Missing content of file {file.access_token}: {file.file.name}')
+                continue
+            batch.append(file)
+            if len(batch) >= options['batch_size']:
+                updated += self.record(batch)
+                batch.clear()
+        updated += self.record(batch)
+        self.stdout.write(self.style.SUCCESS(f'Recorded metadata of {updated} files'))
+
+    @staticmethod
+    def record(batch: list[File]) -> int:
+        """
+        Record the metadata of the files that still have no recorded size, together with their usage.
+        The files are locked, so files deleted, moved to the bin or recorded in the meantime are counted correctly.
+        :return: number of updated files
+        """
+        with transaction.atomic():
+            current = {pk: (user_id, deleted_at) for pk, user_id, deleted_at in File.objects.select_for_update()
+                       .filter(pk__in=[file.pk for file in batch], size__isnull=True)
+                       .values_list('pk', 'user_id', 'deleted_at')}
+            batch = [file for file in batch if file.pk in current]
+            # The files were counted with 0 bytes, their recorded sizes are released when they are deleted
+            usage = {}
+            for file in batch:
+                user_id, deleted_at = current[file.pk]
+                if user_id is not None:
+                    usage.setdefault(user_id, Counter())['bin_bytes' if deleted_at else 'live_bytes'] += file.size
+            for user_id, changes in usage.items():
+                adjust_usage(user_id, **changes)
+            return File.objects.bulk_update(batch, ['filename', 'size', 'sha256', 'mime_type'])
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from Server.models.file_model import File
+from Server.utils.blob_store import store_file
+from Server.utils.file_cleaner import delete_file_rows
+
+
+class Command(BaseCommand):
+    help = ('Upload generated files from concurrent threads and report the write throughput of the database, '
+            'the latency of the uploads and the number of lock errors. The files are uploaded by a throwaway user, '
+            'which is deleted with its files at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16],
+                            help='Numbers of concurrent uploaders to measure')
+        parser.add_argument('--uploads', type=int, default=200, help='Uploads per uploader')
+        parser.add_argument('--size', type=int, default=4096, help='Size of an uploaded file in bytes')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{connection.vendor} {connection.settings_dict["NAME"]}')
+        # A throwaway user, existing users and their files are never touched
+        user = User.objects.create_user(f'benchmark-{uuid.uuid4().hex}')
+        try:
+            for threads in options['threads']:
+                self.measure(user, threads, options['uploads'], options['size'])
+        finally:
+            delete_file_rows(File.objects.filter(user=user))
+            user.delete()
+
+    def measure(self, user: User, threads: int, uploads: int, size: int) -> None:
+        """
+        Run the given number of uploaders at once and report the results.
+        """
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def upload_files() -> None:
+            try:
+                for _ in range(uploads):
+                    content = os.urandom(size)
+                    started = time.perf_counter()
+                    try:
+                        store_file(ContentFile(content, name='benchmark.bin'), hashlib.sha256(content).hexdigest(),
+                                   'application/octet-stream', access_token=uuid.uuid4().hex, user=user)
+                    except OperationalError as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for future in [executor.submit(upload_files) for _ in range(threads)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+        self.stdout.write(f'{threads:>3} uploaders: {len(latencies) / elapsed:8.1f} uploads/s, '
+                          f'p50 {percentile(0.5):7.2f} ms, p95 {percentile(0.95):7.2f} ms, '
+                          f'p99 {percentile(0.99):7.2f} ms, {len(errors)} errors')
+        for error in sorted(set(errors)):
+            self.stdout.write(self.style.ERROR(f'    {error}'))
@@ -0,0 +1,98 @@
+import time
+import uuid
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from Server.models.file_model import File
+from Server.models.share_model import Share
+
+# Markers of a plan that reads the whole table instead of an index
+FULL_SCAN_MARKERS = {
+    'sqlite': lambda plan: any('SCAN' in line and 'INDEX' not in line for line in plan.splitlines()),
+    'postgresql': lambda plan: 'Seq Scan' in plan,
+    'mysql': lambda plan: "'type': 'ALL'" in plan or 'type: ALL' in plan,
+}
+
+
+class Command(BaseCommand):
+    help = ('Fill the tables with generated rows and report the query plans and timings of the hot lookups '
+            'at growing table sizes. All generated rows are rolled back at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Number of files at the last step')
+        parser.add_argument('--steps', type=int, default=4, help='Number of table sizes, growing tenfold')
+        parser.add_argument('--repeat', type=int, default=200, help='Executions of every lookup per step')
+        parser.add_argument('--files-per-user', type=int, default=1000, help='Files owned by one generated user')
+
+    def handle(self, *args, **options):
+        sizes = [max(options['rows'] // 10 ** step, 1) for step in reversed(range(options['steps']))]
+        full_scans = 0
+        with transaction.atomic():
+            created = 0
+            for size in sizes:
+                self.generate_rows(created, size, options['files_per_user'])
+                created = size
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{size} files'))
+                for name, queryset in self.hot_lookups().items():
+                    plan = queryset.explain()
+                    is_full_scan = FULL_SCAN_MARKERS.get(connection.vendor, lambda _: False)(plan)
+                    full_scans += is_full_scan
+                    started = time.perf_counter()
+                    for _ in range(options['repeat']):
+                        list(queryset.all())
+                    elapsed = (time.perf_counter() - started) / options['repeat']
+                    status = self.style.ERROR('FULL SCAN') if is_full_scan else self.style.SUCCESS('index')
+                    self.stdout.write(f'  {name:<32} {elapsed * 1000:8.3f} ms  {status}')
+                    self.stdout.write(f'    {" | ".join(plan.splitlines())}')
+            transaction.set_rollback(True)
+
+        if full_scans:
+            self.stdout.write(self.style.ERROR(f'{full_scans} lookups read whole tables'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All hot lookups use indexes'))
+
+    @staticmethod
+    def generate_rows(start: int, end: int, files_per_user: int) -> None:
+        """
+        Create files with ids from start to end, owned by generated users, every tenth one in the bin
+        and every fifth one shared with the owner of the next block of files.
+        """
+        now = timezone.now()
+        users = list(User.objects.filter(username__startswith='benchmark-').order_by('pk'))
+        while len(users) < end // files_per_user + 2:
+            users.append(User.objects.create(username=f'benchmark-{len(users)}'))
+
+        batch_size = 10_000
+        for batch_start in range(start, end, batch_size):
+            batch = range(batch_start, min(batch_start + batch_size, end))
+            files = File.objects.bulk_create(
+                File(file=f'benchmark/{i}', filename=f'file-{i}.bin', access_token=uuid.uuid4().hex,
+                     user=users[i // files_per_user], size=i,
+                     deleted_at=now - timedelta(days=i % 60) if i % 10 == 0 else None)
+                for i in batch)
+            if files and files[0].pk is None:
+                # Backends without RETURNING do not set the primary keys of bulk created rows
+                files = File.objects.filter(access_token__in=[file.access_token for file in files]).order_by('pk')
+            Share.objects.bulk_create(
+                Share(file=file, shared_with=users[i // files_per_user + 1], shared_by=users[i // files_per_user])
+                for i, file in zip(batch, files) if i % 5 == 0)
+
+    @staticmethod
+    def hot_lookups() -> dict:
+        """
+        Querysets of the lookups done on almost every request and by the cleaner.
+        """
+        file = File.objects.filter(file__startswith='benchmark/').latest('pk')
+        user = file.user
+        expired = timezone.now() - timedelta(days=30)
+        return {
+            'file by access token': File.objects.filter(access_token=file.access_token),
+            'files of user': File.objects.filter(user=user, deleted_at=None).values_list('access_token'),
+            'files of user in bin': File.objects.filter(user=user, deleted_at__isnull=False)
+            .values_list('access_token'),
+            'expired files in bin': File.objects.filter(deleted_at__lt=expired).values_list('pk')[:100],
+            'share of file with user': Share.objects.filter(file=file, shared_with=user),
+            'files shared with user': Share.objects.filter(shared_with=user).order_by('shared_at').values_list('pk'),
+        }
@@ -0,0 +1,251 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from Server.backends.storage import LocalStorage, ShardedStorage, StorageBackend
+
+
+class ConformanceError(Exception):
+    """
+    Raised when a storage backend does not behave as the server expects.
+    """
+
+
+def expect(condition: bool, message: str) -> None:
+    if not condition:
+        raise ConformanceError(message)
+
+
+def get_test_name() -> str:
+    """
+    Get a random name laid out like the name of a blob.
+    """
+    digest = uuid.uuid4().hex
+    return f'uploads/blobs/{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+def check_write_and_read(storage: StorageBackend) -> None:
+    name = get_test_name()
+    content = os.urandom(100_000)
+    storage.write(name, ContentFile(content))
+    expect(storage.exists(name), 'written file does not exist')
+    expect(storage.size(name) == len(content), 'size differs from the written content')
+    with storage.open(name) as f:
+        expect(f.read() == content, 'read content differs from the written content')
+    expect(list(storage.iter_files(name.rsplit('/', 1)[0])) == [name], 'temporary files left next to the file')
+
+
+def check_write_replaces(storage: StorageBackend) -> None:
+    name = get_test_name()
+    storage.write(name, ContentFile(b'first'))
+    storage.write(name, ContentFile(b'second'))
+    with storage.open(name) as f:
+        expect(f.read() == b'second', 'existing file was not replaced')
+
+
+def check_write_moves_temporary_files(storage: StorageBackend) -> None:
+    name = get_test_name()
+    with TemporaryUploadedFile('upload.bin', 'application/octet-stream', 5, None) as upload:
+        upload.write(b'moved')
+        upload.flush()
+        storage.write(name, upload)
+    with storage.open(name) as f:
+        expect(f.read() == b'moved', 'content of the temporary file was not stored')
+
+
+def check_stage(storage: StorageBackend) -> None:
+    name = get_test_name()
+    with TemporaryUploadedFile('upload.bin', 'application/octet-stream', 6, None) as upload:
+        upload.write(b'staged')
+        upload.flush()
+        staged = storage.stage(name, upload)
+        expect(os.path.exists(upload.temporary_file_path()), 'staging did not keep the temporary file')
+    with staged:
+        expect(not storage.exists(name), 'staged content was stored before it was written')
+        storage.write(name, staged)
+    with storage.open(name) as f:
+        expect(f.read() == b'staged', 'content of the staged file was not stored')
+    expect(list(storage.iter_files(name.rsplit('/', 1)[0])) == [name], 'staged file left next to the file')
+    with storage.stage(get_test_name(), ContentFile(b'discarded')):
+        pass
+    expect(not any(name.endswith('.tmp') for name in storage.iter_files('uploads')), 'discarded staged file was kept')
+
+
+def check_ranged_read(storage: StorageBackend) -> None:
+    name = get_test_name()
+    content = os.urandom(300_000)
+    storage.write(name, ContentFile(content))
+    with storage.open(name) as f:
+        for start, length in ((0, 10), (123_456, 70_000), (299_990, 100)):
+            f.seek(start)
+            expect(f.read(length) == content[start:start + length], f'range at {start} differs')
+
+
+def check_copy(storage: StorageBackend) -> None:
+    name, new_name = get_test_name(), get_test_name()
+    storage.write(name, ContentFile(b'original'))
+    storage.write(new_name, ContentFile(b'replaced'))
+    storage.copy(name, new_name)
+    storage.remove(name)
+    with storage.open(new_name) as f:
+        expect(f.read() == b'original', 'copy does not keep the content after the original is removed')
+
+
+def check_missing_files(storage: StorageBackend) -> None:
+    name = get_test_name()
+    expect(not storage.exists(name), 'missing file exists')
+    for operation in (storage.open, storage.size, storage.get_modified_time):
+        try:
+            operation(name)
+        except FileNotFoundError:
+            continue
+        raise ConformanceError(f'{operation.__name__} of a missing file did not raise FileNotFoundError')
+
+
+def check_remove(storage: StorageBackend) -> None:
+    name = get_test_name()
+    storage.write(name, ContentFile(b'content'))
+    expect(storage.remove(name) is True, 'remove of an existing file did not return True')
+    expect(not storage.exists(name), 'removed file exists')
+    expect(storage.remove(name) is False, 'remove of a missing file did not return False')
+
+
+def check_delete_many(storage: StorageBackend) -> None:
+    names = [get_test_name() for _ in range(20)]
+    for name in names[:15]:
+        storage.write(name, ContentFile(b'content'))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        expect(storage.delete_many(names, executor) == 15, 'number of deleted files is wrong')
+    expect(not any(storage.exists(name) for name in names), 'deleted files exist')
+
+
+def check_listing(storage: StorageBackend) -> None:
+    prefix = f'listing/{uuid.uuid4().hex}'
+    names = {f'{prefix}/a/1', f'{prefix}/a/b/2', f'{prefix}/3'}
+    for name in names | {f'{prefix}-other/4'}:
+        storage.write(name, ContentFile(b'content'))
+    expect(set(storage.iter_files(prefix)) == names, 'iter_files did not list exactly the files under the prefix')
+    expect(storage.listdir(prefix) == (['a'], ['3']), 'listdir did not list the directories and files')
+    expect(list(storage.iter_files(f'{prefix}/missing')) == [], 'missing directory was not listed as empty')
+
+
+def check_save_keeps_existing_files(storage: StorageBackend) -> None:
+    name = get_test_name()
+    first = storage.save(name, ContentFile(b'first'))
+    second = storage.save(name, ContentFile(b'second'))
+    expect(first == name and second != name, 'save did not choose another name for an existing file')
+    with storage.open(first) as f:
+        expect(f.read() == b'first', 'save replaced an existing file')
+
+
+CONFORMANCE_CHECKS = [
+    check_write_and_read,
+    check_write_replaces,
+    check_write_moves_temporary_files,
+    check_stage,
+    check_ranged_read,
+    check_copy,
+    check_missing_files,
+    check_remove,
+    check_delete_many,
+    check_listing,
+    check_save_keeps_existing_files,
+]
+
+
+class Command(BaseCommand):
+    help = ('Check that the storage backends behave as the server expects and measure their throughput. '
+            'The backends are created in a temporary directory, the configured storage is not touched.')
+
+    backends = ('local', 'sharded')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', action='append', choices=self.backends, dest='backends',
+                            help='Run only the given backend, can be repeated')
+        parser.add_argument('--files', type=int, default=1000, help='Number of files written, read and deleted')
+        parser.add_argument('--size', type=int, default=64 * 1024, help='Size of a file in bytes')
+        parser.add_argument('--shards', type=int, default=4, help='Number of directories of the sharded backend')
+        parser.add_argument('--workers', type=int, default=8, help='Number of concurrent threads')
+        parser.add_argument('--dir', default=None, help='Directory the backends are created in, e.g. on the disk '
+                                                        'to measure, a temporary directory by default')
+
+    def handle(self, *args, **options):
+        failed = []
+        for backend in options['backends'] or self.backends:
+            root = tempfile.mkdtemp(prefix=f'storage-{backend}-', dir=options['dir'])
+            try:
+                storage = self.create_storage(backend, root, options['shards'])
+                self.stdout.write(f'{backend}: {root}')
+                if not self.check_conformance(storage):
+                    failed.append(backend)
+                    continue
+                self.measure(storage, options['files'], options['size'], options['workers'])
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+        if failed:
+            raise CommandError(f'Backends failed the conformance checks: {", ".join(failed)}')
+
+    @staticmethod
+    def create_storage(backend: str, root: str, shards: int) -> StorageBackend:
+        if backend == 'local':
+            return LocalStorage(location=root)
+        return ShardedStorage(locations=[os.path.join(root, f'shard{index}') for index in range(shards)])
+
+    def check_conformance(self, storage: StorageBackend) -> bool:
+        """
+        Run every check of the storage and report the ones that fail.
+        :return: True if all checks passed
+        """
+        passed = True
+        for check in CONFORMANCE_CHECKS:
+            check_name = check.__name__[len('check_'):]
+            try:
+                check(storage)
+            except Exception as e:
+                passed = False
+                self.stdout.write(self.style.ERROR(f'    {check_name}: FAILED {e!r}'))
+            else:
+                self.stdout.write(f'    {check_name}: ok')
+        return passed
+
+    def measure(self, storage: StorageBackend, files: int, size: int, workers: int) -> None:
+        """
+        Write, read, list and delete the files from concurrent threads and report the throughput of every step.
+        """
+        names = [get_test_name() for _ in range(files)]
+        content = os.urandom(size)
+        range_length = min(4096, size)
+
+        def read(name: str) -> None:
+            with storage.open(name) as f:
+                while f.read(1024 * 1024):
+                    pass
+
+        def read_range(name: str) -> None:
+            with storage.open(name) as f:
+                f.seek(random.randrange(size - range_length + 1))
+                f.read(range_length)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            steps = [
+                ('write', size, lambda: list(executor.map(lambda name: storage.write(name, ContentFile(content)),
+                                                          names))),
+                ('read', size, lambda: list(executor.map(read, names))),
+                ('ranged read', range_length, lambda: list(executor.map(read_range, names))),
+                ('list', 0, lambda: sum(1 for _ in storage.iter_files('uploads'))),
+                ('delete', 0, lambda: storage.delete_many(names, executor)),
+            ]
+            for step, step_bytes, run in steps:
+                started = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - started
+                line = f'    {step:<12} {files / elapsed:10.1f} files/s'
+                if step_bytes:
+                    line += f' {files * step_bytes / elapsed / 1024 ** 2:10.1f} MB/s'
+                self.stdout.write(line)
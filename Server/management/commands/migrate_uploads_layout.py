@@ -0,0 +1,58 @@
+import time
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Server.models.file_model import File
+from Server.utils.blob_store import inspect_file, move_to_blob
+from Server.settings import BLOB_UPLOAD_DIR
+
+
+class Command(BaseCommand):
+    help = ('Move files stored before blobs were introduced, e.g. in the uploads/YYYY/MM/DD directories, into the '
+            'sharded blob layout. Runs while the server is running, in batches with one transaction per batch, '
+            'and can be interrupted and run again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Number of files moved per transaction')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to wait between batches, to leave the database to the server')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the files that would be moved')
+
+    def handle(self, *args, **options):
+        legacy_files = File.objects.filter(blob__isnull=True).exclude(file__startswith=f'{BLOB_UPLOAD_DIR}/')
+        if options['dry_run']:
+            self.stdout.write(f'Would move {legacy_files.count()} files')
+            return
+
+        moved = skipped = 0
+        last_pk = 0
+        while batch := list(legacy_files.filter(pk__gt=last_pk).order_by('pk')[:options['batch_size']]):
+            last_pk = batch[-1].pk
+            contents = []
+            # The content is hashed before the transaction, the database is not locked while it is read
+            for file in batch:
+                try:
+                    contents.append((file, *self.inspect(file)))
+                except FileNotFoundError:
+                    skipped += 1
+                    self.stderr.write(f'Missing content of file {file.access_token}: {file.file.name}')
+            with transaction.atomic():
+                for file, sha256, size in contents:
+                    if move_to_blob(file, sha256, size):
+                        moved += 1
+                    else:
+                        skipped += 1
+            self.stdout.write(f'Moved {moved} files so far')
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} files, skipped {skipped}'))
+
+    @staticmethod
+    def inspect(file: File) -> tuple[str, int]:
+        """
+        Get the digest and the size of the content of the file, read from the storage unless they were recorded.
+        """
+        if file.sha256 and file.size is not None:
+            return file.sha256, file.size
+        with default_storage.open(file.file.name) as source:
+            return inspect_file(source, file.get_original_filename())[0], source.size
@@ -0,0 +1,57 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from Server.models.file_model import File
+from Server.models.usage_model import UserUsage
+
+
+class Command(BaseCommand):
+    help = ('Recalculate the usage counters of all users from their files, e.g. after files were stored '
+            'before the counters existed or changed outside of the API. Counters that differ are reported.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the counters that differ')
+
+    def handle(self, *args, **options):
+        unrecorded = File.objects.filter(user__isnull=False, size__isnull=True).count()
+        if unrecorded:
+            self.stderr.write(f'{unrecorded} files have no recorded size and are counted with 0 bytes, '
+                              f'run backfill_file_metadata to record their sizes')
+        fields = ['live_bytes', 'live_files', 'bin_bytes', 'bin_files']
+        empty = dict.fromkeys(fields, 0)
+
+        changed = 0
+        with transaction.atomic():
+            # Lock the counters before the files are summed up, uploads and deletions wait until
+            # the recalculated values are written
+            usages = {usage.user_id: usage for usage in UserUsage.objects.select_for_update()}
+            totals = self.get_totals()
+            for user_id in User.objects.values_list('pk', flat=True).iterator():
+                expected = {field: totals.get(user_id, empty)[field] for field in fields}
+                usage = usages.get(user_id)
+                current = {field: getattr(usage, field) for field in fields} if usage else empty
+                if current == expected and usage is not None:
+                    continue
+                changed += 1
+                self.stdout.write(f'user {user_id}: {current} -> {expected}')
+                if not options['dry_run']:
+                    UserUsage.objects.update_or_create(user_id=user_id, defaults=expected)
+        self.stdout.write(f'{"Would update" if options["dry_run"] else "Updated"} {changed} users')
+
+    @staticmethod
+    def get_totals() -> dict[int, dict]:
+        """
+        Sum up the files of every user with one query. Files without a recorded size count with 0 bytes,
+        as they do for the counters, until backfill_file_metadata records their sizes.
+        :return: dictionary of the totals by the primary keys of the users
+        """
+        live = Q(deleted_at__isnull=True)
+        in_bin = Q(deleted_at__isnull=False)
+        return {row['user_id']: row for row in File.objects.filter(user__isnull=False).values('user_id').annotate(
+            live_bytes=Coalesce(Sum('size', filter=live), Value(0)),
+            live_files=Count('pk', filter=live),
+            bin_bytes=Coalesce(Sum('size', filter=in_bin), Value(0)),
+            bin_files=Count('pk', filter=in_bin),
+        )}
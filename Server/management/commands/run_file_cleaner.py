@@ -0,0 +1,55 @@
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from Server.utils.file_cleaner import CLEANUPS, main, run_cleanup
+from Server.utils.leader_lock import LeaderLock, LockNotAcquired
+from Server.settings import CLEANER_SCHEDULES, CLEANER_LOCK_FILE
+
+
+class Command(BaseCommand):
+    help = ('Run the cleanups of files in the bin, orphaned files and abandoned uploads, daily at the times '
+            'of CLEANER_SCHEDULES. Only one instance runs at a time, others exit.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the cleanups once and exit')
+        parser.add_argument('--cleanup', action='append', choices=list(CLEANUPS), dest='cleanups',
+                            help='Run only the given cleanup, can be repeated')
+        parser.add_argument('--at', action='append', default=[], metavar='CLEANUP=HH:MM',
+                            help='Override the time of day of a cleanup, can be repeated')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+        parser.add_argument('--lock-file', default=CLEANER_LOCK_FILE, help='Path to the leader lock file')
+
+    def handle(self, *args, **options):
+        schedules = {name: at for name, at in CLEANER_SCHEDULES.items()
+                     if not options['cleanups'] or name in options['cleanups']}
+        for override in options['at']:
+            name, _, at = override.partition('=')
+            if name not in CLEANUPS or not at:
+                raise CommandError(f'Invalid schedule "{override}", expected CLEANUP=HH:MM')
+            schedules[name] = at
+
+        try:
+            with LeaderLock(options['lock_file']):
+                if options['once']:
+                    self.run_once(schedules, options['dry_run'])
+                else:
+                    self.stdout.write(f'Scheduled cleanups: '
+                                      f'{", ".join(f"{name} at {at}" for name, at in schedules.items())}')
+                    asyncio.run(main(schedules, options['dry_run']))
+        except LockNotAcquired as e:
+            raise CommandError(f'{e}, another cleaner is running')
+
+    def run_once(self, schedules: dict[str, str], dry_run: bool) -> None:
+        """
+        Run the scheduled cleanups one after another and report how much each deleted.
+        """
+        failed = []
+        for name in schedules:
+            try:
+                deleted = run_cleanup(name, dry_run)
+            except Exception as e:
+                failed.append(name)
+                self.stderr.write(f'{name}: failed: {e}')
+                continue
+            self.stdout.write(f'{name}: {"would delete" if dry_run else "deleted"} {deleted}')
+        if failed:
+            raise CommandError(f'Cleanups failed: {", ".join(failed)}')
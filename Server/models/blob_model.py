@@ -0,0 +1,7 @@
+from django.db import models
+
+
+class Blob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
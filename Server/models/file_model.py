@@ -1,13 +1,44 @@
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
+from Server.models.blob_model import Blob
 
 
 class File(models.Model):
     file = models.FileField(upload_to='uploads/%Y/%m/%d')
+    filename = models.CharField(max_length=255, blank=True, default='')
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='files')
     access_token = models.CharField(max_length=255, unique=True)
     password = models.CharField(max_length=255, blank=True, null=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    uploaded_at = models.DateTimeField(default=timezone.now, editable=False)
+    size = models.BigIntegerField(null=True, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    mime_type = models.CharField(max_length=255, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='file_user_deleted_at_idx'),
+            # Only files in the bin are indexed, the cleaner scans them for expired ones
+            models.Index(fields=['deleted_at'], name='file_in_bin_deleted_at_idx',
+                         condition=models.Q(deleted_at__isnull=False)),
+        ]
 
     def get_original_filename(self):
-        return self.file.name.split('/')[-1]
+        return self.filename or self.file.name.split('/')[-1]
+
+    def get_size(self):
+        """
+        Size of the stored file in bytes. Recorded at upload time, only files uploaded before
+        that was done need to be looked up on the disk.
+        """
+        return self.size if self.size is not None else self.file.size
+
+    def get_etag(self):
+        """
+        Entity tag of the stored file. The SHA-256 recorded at upload time identifies the content.
+        Stored files are never modified, so for files without a digest the access token
+        together with the upload time identifies the content as well.
+        """
+        return self.sha256 or f'{self.access_token}-{int(self.uploaded_at.timestamp())}'
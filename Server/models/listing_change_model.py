@@ -0,0 +1,19 @@
+from django.db import models
+from django.utils import timezone
+
+
+class ListingChange(models.Model):
+    """
+    A file that was added to, changed in or removed from one of the listings of a user.
+    The primary key of the latest change of a user is the version of the listings of the user.
+    The user is not a foreign key, changes of deleted users are pruned together with all other old changes.
+    """
+    user_id = models.IntegerField()
+    listing = models.CharField(max_length=16)  # 'files', 'bin' or 'shared'
+    access_token = models.CharField(max_length=255)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'id'], name='listing_change_user_id_idx'),
+        ]
@@ -7,4 +7,12 @@ class Share(models.Model):
     file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='shared_files')
     shared_with = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='received_files')
     shared_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='shared_files')
-    shared_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    shared_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['shared_with', 'shared_at'], name='share_shared_with_at_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'shared_with'], name='share_file_shared_with_unique'),
+        ]
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.db import models
+
+
+class UploadSession(models.Model):
+    upload_id = models.CharField(max_length=255, unique=True)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    password = models.CharField(max_length=255, blank=True, null=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.db import models
+
+
+class UserUsage(models.Model):
+    """
+    Storage used by the files of a user, kept up to date whenever files are uploaded, moved to or out of the bin
+    and deleted, so it never has to be summed up from the files. Files in the bin count towards the quota.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='usage')
+    live_bytes = models.BigIntegerField(default=0)
+    live_files = models.IntegerField(default=0)
+    bin_bytes = models.BigIntegerField(default=0)
+    bin_files = models.IntegerField(default=0)
+    quota = models.BigIntegerField(null=True, blank=True)  # Bytes, DEFAULT_USER_QUOTA if not set
@@ -9,21 +9,26 @@ https://docs.djangoproject.com/en/5.0/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
+import atexit
 import os
+import queue
 from pathlib import Path
 import logging
+import logging.handlers
+from Server.utils.logging_handlers import DroppingQueueHandler, SamplingFilter
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 # Create a logger
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)  # Log all messages of severity DEBUG and above
+logger.setLevel(os.environ.get('LOG_LEVEL', 'DEBUG').upper())  # Log all messages of this severity and above
 
-# Create a file handler
-log_file_path = os.path.join(BASE_DIR, 'application.log')
-handler = logging.FileHandler(log_file_path)
-handler.setLevel(logging.DEBUG)  # Write all messages of severity DEBUG and above to the file
+# Create a rotating file handler, it is only used by the listener thread so requests never wait for the disk
+log_file_path = os.environ.get('LOG_FILE', os.path.join(BASE_DIR, 'application.log'))
+handler = logging.handlers.RotatingFileHandler(log_file_path,
+                                               maxBytes=int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+                                               backupCount=int(os.environ.get('LOG_BACKUP_COUNT', 5)))
 
 # Create a formatter
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
@@ -31,10 +36,57 @@ formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 # Set the formatter for the handler
 handler.setFormatter(formatter)
 
+# Records are put on a bounded queue and written by a listener thread, dropped if the queue is full
+log_queue = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+queue_handler = DroppingQueueHandler(log_queue)
+# Fraction of DEBUG records written, from 0 to 1, all records of higher severity are written
+queue_handler.addFilter(SamplingFilter(float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1.0))))
+
 # Add the handler to the logger
-logger.addHandler(handler)
+logger.addHandler(queue_handler)
+log_listener = logging.handlers.QueueListener(log_queue, handler)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 MAX_FILE_SIZE = 1024 * 1024 * 1024  # 1 GB
+FILE_STREAM_BLOCK_SIZE = 64 * 1024  # 64 KB read per chunk when streaming downloads
+MAX_RANGES_PER_REQUEST = 16  # Range headers with more ranges are ignored and the whole file is sent
+ENCRYPTED_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'encrypted')
+ENCRYPTED_CACHE_MAX_SIZE = 5 * 1024 * 1024 * 1024  # 5 GB of encrypted archives kept for repeated downloads
+ARCHIVE_COMPRESSION_LEVEL = 6  # Default compression level of bulk downloads, 0 stores files uncompressed
+ARCHIVE_COMPRESSION_WORKERS = os.cpu_count() or 1  # Threads compressing bulk downloads in parallel
+ARCHIVE_COMPRESSION_BLOCK_SIZE = 1024 * 1024  # 1 MB compressed by one worker into a separate gzip member
+CHUNKED_UPLOAD_DIR = 'partial_uploads'  # Resumable uploads are assembled here before being moved to uploads
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024  # 64 MB
+BLOB_UPLOAD_DIR = 'uploads/blobs'  # Content-addressed storage shared by all files with identical content
+STORAGE_LISTING_WORKERS = 8  # Threads walking the directories of the storage in parallel, e.g. for the cleaner
+LISTING_DEFAULT_SORT = 'date'  # Order of file listings requested without the 'sort' parameter
+LISTING_MAX_PAGE_SIZE = 1000  # Maximum 'limit' of one page of a file listing
+LISTING_CACHE_TTL = 5 * 60  # Seconds for which a serialized listing of a user is kept in the cache
+LISTING_VERSION_TTL = 60  # Seconds a version is cached, bounds how long another process may serve an outdated listing
+LISTING_CHANGES_RETENTION_DAYS = 30  # Days after which recorded listing changes are deleted, older clients reload
+EVENT_BUS = {  # Delivers changes of the listings to the event streams, LocalEventBus only within one process
+    'BACKEND': 'Server.utils.event_bus.LocalEventBus',
+    'OPTIONS': {'queue_size': 100},
+}
+EVENT_STREAM_HEARTBEAT = 15  # Seconds between comments keeping idle event streams open, changes are checked too
+BATCH_MAX_SIZE = 1000  # Maximum number of files changed by one batch request
+CLEANER_BATCH_SIZE = 1000  # Rows deleted in one transaction by the file cleaner
+CLEANER_REMOVAL_WORKERS = 8  # Threads removing files from the disk during a cleanup
+CLEANER_GRACE_PERIOD = 60 * 60  # Seconds for which new files are never considered orphaned
+CLEANER_EXPIRATION_DAYS = 30  # Days after which files in the bin are deleted
+CLEANER_UPLOAD_EXPIRATION_DAYS = 1  # Days after which incomplete resumable uploads are deleted
+CLEANER_SCHEDULES = {  # Time of day at which every cleanup of the run_file_cleaner command runs
+    'expired_files': '00:00',
+    'files_not_connected_to_db': '00:00',
+    'files_not_in_uploads_folder': '00:00',
+    'abandoned_uploads': '00:00',
+    'old_listing_changes': '00:00',
+}
+CLEANER_LOCK_FILE = os.path.join(BASE_DIR, 'cleaner.lock')  # Only the process holding this lock runs cleanups
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # Bearer token of the metrics endpoint, staff only if empty
+# Bytes a user may store including the bin, unlimited if not set. UserUsage.quota overrides it per user.
+DEFAULT_USER_QUOTA = int(os.environ['DEFAULT_USER_QUOTA']) if os.environ.get('DEFAULT_USER_QUOTA') else None
 
 
 
@@ -64,6 +116,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Server.utils.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,6 +126,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+FILE_UPLOAD_HANDLERS = [
+    'Server.utils.upload_handlers.HashingFileUploadHandler',
+]
+
 ROOT_URLCONF = 'Server.urls'
 
 TEMPLATES = [
@@ -98,17 +155,154 @@ WSGI_APPLICATION = 'Server.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# The profile is selected with the DB_ENGINE environment variable: 'sqlite' for a single node,
+# 'mysql' or 'postgresql' for concurrent writers. PostgreSQL requires the psycopg package.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+DATABASE_PROFILES = {
+    'sqlite': {
+        'ENGINE': 'Server.backends.sqlite3',  # SQLite with SQLITE_PRAGMAS and immediate transactions
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            'timeout': 20,  # Seconds a writer waits for the write lock before 'database is locked' is raised
+        },
+    },
+    'mysql': {
+        'ENGINE': 'django.db.backends.mysql',
+        'NAME': os.environ.get('DB_NAME', 'ffs'),
+        'USER': os.environ.get('DB_USER', 'root'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', '1111'),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', '3306'),
+        'OPTIONS': {
+            'charset': 'utf8mb4',
+            'isolation_level': 'read committed',
+        },
+    },
+    'postgresql': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DB_NAME', 'ffs'),
+        'USER': os.environ.get('DB_USER', 'postgres'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', '5432'),
+        # Required behind a transaction pooling PgBouncer
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER', '') == 'pgbouncer',
+    },
+}
+
+SERVER_INTERFACE = os.environ.get('SERVER_INTERFACE', 'wsgi')  # Set to 'asgi' by Server.asgi
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-        'USER': 'root',
-        'PASSWORD': '1111',
-        'HOST': 'localhost',
-        'PORT': '3306'
+        **DATABASE_PROFILES[DB_ENGINE],
+        # Connections are kept open and reused by the requests of a thread instead of opened per request.
+        # Under ASGI, synchronous views run in changing threads and their persistent connections are never closed
+        # (Django ticket #33497), so connections are opened per request unless DB_CONN_MAX_AGE is set
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE',
+                                           0 if DB_ENGINE == 'sqlite' or SERVER_INTERFACE == 'asgi' else 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Pragmas set on every new SQLite connection by Server.backends.sqlite3. In WAL mode readers do not block
+# the writer and the writer does not block readers, synchronous=NORMAL only syncs the WAL at checkpoints.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'cache_size': -64000,  # 64 MB
+    'temp_store': 'MEMORY',
+    'mmap_size': 256 * 1024 * 1024,
+    'foreign_keys': 'ON',
+}
+
+
+# Storage
+# The backend of the uploaded files is selected with the STORAGE_BACKEND environment variable: 'local' keeps them
+# in one directory, 'sharded' spreads them over the directories listed in STORAGE_SHARDS, e.g. one per disk.
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+
+STORAGE_PROFILES = {
+    'local': {
+        'BACKEND': 'Server.backends.storage.LocalStorage',
+    },
+    'sharded': {
+        'BACKEND': 'Server.backends.storage.ShardedStorage',
+        'OPTIONS': {
+            # Separated like PATH, must not be changed once files are stored
+            'locations': [location for location in os.environ.get('STORAGE_SHARDS', '').split(os.pathsep)
+                          if location],
+        },
+    },
+}
+
+STORAGES = {
+    'default': STORAGE_PROFILES[STORAGE_BACKEND],
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+
+# Caches and sessions
+# Sessions and the users of the sessions are read from the cache instead of the database on every request.
+# The file cache is shared by all processes of the host, the local memory cache only suits a single process,
+# Redis (requires `redis`) is shared by all hosts.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'file')
+
+# The file and local memory caches cull 1/CULL_FREQUENCY of their entries at random once they hold MAX_ENTRIES.
+# Django defaults to 300 entries, far fewer than the sessions, users and listings of the active users.
+CACHE_OPTIONS = {
+    'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 100000)),
+    'CULL_FREQUENCY': 10,
+}
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+        'OPTIONS': CACHE_OPTIONS,
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'django'),
+        'OPTIONS': CACHE_OPTIONS,
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'redis://localhost:6379'),
+    },
+}
+
+# Sessions are kept in a cache of their own, listings filling the default cache do not cull them
+SESSION_CACHE_BACKENDS = {
+    'locmem': {**CACHE_BACKENDS['locmem'], 'LOCATION': 'sessions'},
+    'file': {**CACHE_BACKENDS['file'], 'LOCATION': os.path.join(BASE_DIR, 'cache', 'sessions')},
+    'redis': {**CACHE_BACKENDS['redis'], 'KEY_PREFIX': 'sessions'},
+}
+
+CACHES = {
+    'default': CACHE_BACKENDS[CACHE_BACKEND],
+    'sessions': SESSION_CACHE_BACKENDS[CACHE_BACKEND],
+}
+SESSION_CACHE_ALIAS = 'sessions'
+
+# 'cached_db' writes sessions through to the database and reads them from the cache,
+# 'cache' keeps them only in the cache and 'db' only in the database. Sessions kept only in the file or
+# local memory cache are lost when it is culled, 'cache' suits Redis only.
+SESSION_ENGINE = f"django.contrib.sessions.backends.{os.environ.get('SESSION_BACKEND', 'cached_db')}"
+
+# Users log in with the cached backend. ModelBackend still loads the users of sessions created before it was added,
+# so they stay logged in.
+AUTHENTICATION_BACKENDS = [
+    'Server.utils.auth_backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))  # Seconds a user of a session is cached for
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
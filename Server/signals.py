@@ -0,0 +1,87 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from Server.models.file_model import File
+from Server.models.share_model import Share
+from Server.utils.archive_cache import invalidate_archives
+from Server.utils.auth_backends import invalidate_cached_user
+from Server.utils.blob_store import release_blob, release_listing_entry, release_name, release_share, \
+    release_usage
+from Server.utils.listing_cache import record_changes
+
+
+@receiver(post_save, sender=File)
+def invalidate_archives_on_save(sender, instance: File, created: bool, **kwargs) -> None:
+    """
+    Drop the cached encrypted archives of a file that was changed, e.g. moved to the bin or replaced.
+    """
+    if not created:
+        invalidate_archives(instance.pk)
+
+
+@receiver(post_delete, sender=File)
+def invalidate_archives_on_delete(sender, instance: File, **kwargs) -> None:
+    """
+    Drop the cached encrypted archives of a deleted file.
+    """
+    invalidate_archives(instance.pk)
+
+
+@receiver(post_delete, sender=File)
+def release_content_on_delete(sender, instance: File, **kwargs) -> None:
+    """
+    Drop the reference of a deleted file to its blob. The blob is removed from the disk with its last reference.
+    The file no longer counts towards the usage of its user.
+    Files stored before blobs were introduced own their content and it is removed with them.
+    """
+    if instance.user_id is not None:
+        release_usage(instance.user_id, instance.size or 0, instance.deleted_at is not None)
+    if instance.blob_id is not None:
+        release_blob(instance.blob_id)
+    elif instance.file:
+        release_name(instance.file.name)
+
+
+@receiver(post_save, sender=File)
+def record_listing_change_on_save(sender, instance: File, created: bool, **kwargs) -> None:
+    """
+    Record the change of the listings of the owner. A changed file may have been moved into or out of the bin.
+    """
+    if instance.user_id is not None:
+        listings = ['files'] if created else ['files', 'bin']
+        record_changes((instance.user_id, listing, instance.access_token) for listing in listings)
+
+
+@receiver(post_delete, sender=File)
+def record_listing_change_on_delete(sender, instance: File, **kwargs) -> None:
+    """
+    Record the removal of a deleted file from the listings of the owner, together with the batch it was deleted in.
+    """
+    if instance.user_id is not None:
+        release_listing_entry(instance)
+
+
+@receiver(post_save, sender=Share)
+def record_listing_change_of_new_share(sender, instance: Share, **kwargs) -> None:
+    """
+    Record the change of the listing of the files shared with the user.
+    """
+    record_changes([(instance.shared_with_id, 'shared', instance.file.access_token)])
+
+
+@receiver(post_delete, sender=Share)
+def record_listing_change_of_deleted_share(sender, instance: Share, **kwargs) -> None:
+    """
+    Record the removal of a deleted share from the listing of the files shared with the user,
+    together with the batch it was deleted in.
+    """
+    release_share(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user_on_change(sender, instance: User, **kwargs) -> None:
+    """
+    Drop the cached user of the sessions, so a changed password or a deactivated account takes effect immediately.
+    """
+    invalidate_cached_user(instance.pk)
@@ -0,0 +1,15 @@
+from django.test import SimpleTestCase
+from Server.utils.file_operations import get_unique_arcnames
+
+
+class GetUniqueArcnamesTests(SimpleTestCase):
+    def test_unique_names_are_kept(self):
+        self.assertEqual(get_unique_arcnames(['a.txt', 'b.txt']), ['a.txt', 'b.txt'])
+
+    def test_repeated_names_are_numbered(self):
+        self.assertEqual(get_unique_arcnames(['report.pdf', 'notes', 'report.pdf', 'notes', 'report.pdf']),
+                         ['report.pdf', 'notes', 'report (1).pdf', 'notes (1)', 'report (2).pdf'])
+
+    def test_names_of_other_files_are_skipped(self):
+        self.assertEqual(get_unique_arcnames(['report.pdf', 'report.pdf', 'report (1).pdf']),
+                         ['report.pdf', 'report (2).pdf', 'report (1).pdf'])
@@ -0,0 +1,37 @@
+import json
+from django.test import SimpleTestCase
+from django.utils import timezone
+from django.utils.http import urlsafe_base64_encode
+from Server.utils.listings import ListingError, decode_cursor, encode_cursor
+
+
+def make_cursor(*values) -> str:
+    return urlsafe_base64_encode(json.dumps(list(values)).encode())
+
+
+class DecodeCursorTests(SimpleTestCase):
+    def test_cursors_are_decoded(self):
+        uploaded_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor('-date', uploaded_at, 7), '-date'), (uploaded_at, 7))
+        self.assertEqual(decode_cursor(encode_cursor('name', 'a.txt', 3), 'name'), ('a.txt', 3))
+        self.assertEqual(decode_cursor(encode_cursor('size', 1024, 5), 'size'), (1024, 5))
+
+    def test_cursor_of_another_sort_order_is_rejected(self):
+        with self.assertRaisesMessage(ListingError, 'Cursor does not match the sort order'):
+            decode_cursor(encode_cursor('name', 'a.txt', 3), 'size')
+
+    def test_tampered_cursors_are_rejected(self):
+        cursors = [
+            ('date', make_cursor('date', 5, 1)),
+            ('date', make_cursor('date', 'yesterday', 1)),
+            ('name', make_cursor('name', 'a.txt', 'x')),
+            ('name', make_cursor('name', 'a.txt', True)),
+            ('name', make_cursor('name', 'a.txt', 1.5)),
+            ('size', make_cursor('size', '10', 1)),
+            ('size', make_cursor('size', 10)),
+            ('size', make_cursor({'sort': 'size'})),
+            ('size', 'not-base64!'),
+        ]
+        for sort, cursor in cursors:
+            with self.subTest(cursor=cursor), self.assertRaises(ListingError):
+                decode_cursor(cursor, sort)
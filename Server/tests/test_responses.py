@@ -0,0 +1,68 @@
+from django.core.files.base import ContentFile
+from django.test import RequestFactory, SimpleTestCase
+from django.utils import timezone
+from Server.utils.responses import conditional_response, parse_range_header, ranged_file_response
+from Server.settings import MAX_RANGES_PER_REQUEST
+
+
+class ParseRangeHeaderTests(SimpleTestCase):
+    def test_single_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-499', 1000), [(0, 499)])
+        self.assertEqual(parse_range_header('bytes=500-', 1000), [(500, 999)])
+        self.assertEqual(parse_range_header('bytes=-200', 1000), [(800, 999)])
+
+    def test_ranges_are_clamped_to_the_size(self):
+        self.assertEqual(parse_range_header('bytes=900-2000', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), [(0, 999)])
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        self.assertEqual(parse_range_header('bytes=500-599,0-99,100-199,550-700', 1000), [(0, 199), (500, 700)])
+
+    def test_unsatisfiable_ranges_are_dropped(self):
+        self.assertEqual(parse_range_header('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range_header('bytes=0-9,2000-3000', 1000), [(0, 9)])
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
+
+    def test_ranges_of_an_empty_file_are_unsatisfiable(self):
+        self.assertEqual(parse_range_header('bytes=0-', 0), [])
+        self.assertEqual(parse_range_header('bytes=-5', 0), [])
+
+    def test_malformed_headers_are_ignored(self):
+        for header in ('items=0-9', 'bytes=', 'bytes=-', 'bytes=a-b', 'bytes=9-0', 'bytes=0-9,,'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range_header(header, 1000))
+
+    def test_too_many_ranges_are_ignored(self):
+        header = 'bytes=' + ','.join(f'{i * 10}-{i * 10}' for i in range(MAX_RANGES_PER_REQUEST + 1))
+        self.assertIsNone(parse_range_header(header, 100_000))
+
+
+class RangedFileResponseTests(SimpleTestCase):
+    def get_response(self, content: bytes, range_header: str):
+        request = RequestFactory().get('/', HTTP_RANGE=range_header)
+        return ranged_file_response(request, ContentFile(content), 'file.txt', len(content), 'etag', timezone.now())
+
+    def test_suffix_range_of_an_empty_file_is_not_satisfiable(self):
+        response = self.get_response(b'', 'bytes=-5')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */0')
+
+    def test_single_range_is_sent_with_its_content_range(self):
+        response = self.get_response(b'0123456789', 'bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+
+
+class ConditionalResponseTests(SimpleTestCase):
+    def test_weak_etag_matches_if_none_match(self):
+        request = RequestFactory().get('/', HTTP_IF_NONE_MATCH='W/"abc-zip"')
+        response = conditional_response(request, 'abc-zip', timezone.now(), weak=True)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], 'W/"abc-zip"')
+
+    def test_weak_etag_never_matches_if_match(self):
+        request = RequestFactory().get('/', HTTP_IF_MATCH='W/"abc-zip"')
+        self.assertEqual(conditional_response(request, 'abc-zip', timezone.now(), weak=True).status_code, 412)
+        request = RequestFactory().get('/', HTTP_IF_MATCH='"abc"')
+        self.assertIsNone(conditional_response(request, 'abc', timezone.now()))
@@ -1,25 +1,41 @@
 from django.urls import path
 from Server.views.auth_views import login_user, logout_user, register_user, session_info
+from Server.views.batch_views import delete_files, put_files_in_bin, recover_files, share_files
 from Server.views.bin_views import recover_file, get_files_in_bin, put_file_in_bin
 from Server.views.file_views import file_view, get_user_filenames, get_user_files
+from Server.views.listing_views import get_listing_changes, stream_listing_changes
+from Server.views.metrics_views import get_metrics
 from Server.views.share_views import share_view
+from Server.views.upload_views import upload_view, complete_upload
+from Server.views.usage_views import get_user_usage
 from Server.views.utils_views import get_csrf_token
 
 
 urlpatterns = [
     path('file/', file_view, name='file_operations'),
+    path('file/batch/', delete_files, name='delete_files'),
+    path('file/batch/bin/', put_files_in_bin, name='put_files_in_bin'),
+    path('file/batch/restore/', recover_files, name='restore_files_from_bin'),
     path('file/<str:access_token>/', file_view, name='file_operations_with_token'),
     path('file/bin/all/', get_files_in_bin, name='get_files_in_bin'),
     path('file/bin/<str:access_token>/', put_file_in_bin, name='put_file_in_bin'),
     path('file/bin/restore/<str:access_token>/', recover_file, name='restore_file_from_bin'),
+    path('listing/changes/', get_listing_changes, name='get_listing_changes'),
+    path('listing/events/', stream_listing_changes, name='stream_listing_changes'),
     path('getcsrf/', get_csrf_token, name='get_csrf_token'),
+    path('metrics/', get_metrics, name='get_metrics'),
     path('session_info/', session_info, name='get_session_info'),
     path('login/', login_user, name='login_user'),
     path('logout/', logout_user, name='logout_user'),
     path('register/', register_user, name='register_user'),
     path('user_filenames/', get_user_filenames, name='get_user_filenames'),
     path('user_files/', get_user_files, name='get_user_files'),
+    path('share/batch/', share_files, name='share_files_with_user'),
     path('share/<str:access_token>/<str:shared_with>/', share_view, name='share_file_with_user'),
     path('share/<str:access_token>/', share_view, name='make_file_private'),
     path('share/', share_view, name='get_shared_files'),
+    path('upload/', upload_view, name='initiate_upload'),
+    path('upload/<str:upload_id>/', upload_view, name='upload_operations'),
+    path('upload/<str:upload_id>/complete/', complete_upload, name='complete_upload'),
+    path('usage/', get_user_usage, name='get_user_usage'),
 ]
@@ -0,0 +1,109 @@
+import hashlib
+import hmac
+import os
+import shutil
+import uuid
+from typing import BinaryIO, Iterator
+from Server.models.file_model import File
+from Server.settings import logger, SECRET_KEY, ENCRYPTED_CACHE_DIR, ENCRYPTED_CACHE_MAX_SIZE
+
+
+def get_cache_path(file: File, password: str) -> str:
+    """
+    Get the path of the cached encrypted archive of the file. Entries of one file share a directory,
+    so that they can be invalidated together. The password is only part of a keyed hash.
+    The key covers the stored content and the name of the entry in the archive, so a file moved
+    to another blob or renamed gets a new entry.
+    :param file: File object
+    :param password: string containing the password
+    :return: string containing the path to the cache entry
+    """
+    message = f'{file.pk}:{file.file.name}:{file.get_original_filename()}:{password}'
+    key = hmac.new(SECRET_KEY.encode(), message.encode(), hashlib.sha256)
+    return os.path.join(ENCRYPTED_CACHE_DIR, str(file.pk), key.hexdigest() + '.zip')
+
+
+def open_cached_archive(file: File, password: str) -> BinaryIO | None:
+    """
+    Open the cached encrypted archive of the file and mark it as recently used.
+    :param file: File object
+    :param password: string containing the password
+    :return: opened cache entry, None if the archive is not cached
+    """
+    path = get_cache_path(file, password)
+    try:
+        cached_archive = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    os.utime(path)
+    logger.debug(f"Serving encrypted archive from cache: {path}")
+    return cached_archive
+
+
+def cache_archive(file: File, password: str, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Pass the chunks of the encrypted archive through while writing them to the cache.
+    The entry is published only after the whole archive was produced, an interrupted download leaves nothing behind.
+    If the archives of the file were invalidated in the meantime, the archive is not cached.
+    :param file: File object
+    :param password: string containing the password
+    :param chunks: iterator over the bytes of the encrypted archive
+    :return: iterator over the same bytes
+    """
+    path = get_cache_path(file, password)
+    temporary_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with open(temporary_path, 'wb') as cache_file:
+            for chunk in chunks:
+                cache_file.write(chunk)
+                yield chunk
+        try:
+            os.replace(temporary_path, path)
+        except FileNotFoundError:
+            # invalidate_archives removed the directory of the file while the archive was produced
+            logger.debug(f"Encrypted archive invalidated before it was cached: {path}")
+            return
+    finally:
+        try:
+            os.remove(temporary_path)
+        except FileNotFoundError:
+            pass
+    evict_archives(ENCRYPTED_CACHE_MAX_SIZE)
+
+
+def invalidate_archives(file_id: int) -> None:
+    """
+    Remove all cached encrypted archives of the file.
+    :param file_id: primary key of the File object
+    :return: None
+    """
+    shutil.rmtree(os.path.join(ENCRYPTED_CACHE_DIR, str(file_id)), ignore_errors=True)
+
+
+def evict_archives(max_size: int) -> None:
+    """
+    Remove the least recently used cache entries until the cache takes at most max_size bytes.
+    :param max_size: maximum size of the cache in bytes
+    :return: None
+    """
+    entries = []
+    for directory in os.scandir(ENCRYPTED_CACHE_DIR):
+        try:
+            for entry in os.scandir(directory):
+                if entry.is_file() and entry.name.endswith('.zip'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+            logger.debug(f"Evicted encrypted archive from cache: {path}")
+        except FileNotFoundError:
+            pass
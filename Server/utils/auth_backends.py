@@ -0,0 +1,39 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from Server.settings import USER_CACHE_TTL
+
+
+def get_user_cache_key(user_id) -> str:
+    """
+    Get the key under which the user with the given id is cached.
+    :param user_id: primary key of the user
+    :return: string containing the cache key
+    """
+    return f'auth-user:{user_id}'
+
+
+def invalidate_cached_user(user_id) -> None:
+    """
+    Remove the user with the given id from the cache, e.g. after the password was changed.
+    :param user_id: primary key of the user
+    :return: None
+    """
+    cache.delete(get_user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    Authentication backend loading the user of a session from the cache, so authenticated requests
+    do not read the user table. Users are cached for USER_CACHE_TTL seconds and dropped from the cache
+    when they are saved or deleted, see Server.signals.
+    """
+
+    def get_user(self, user_id) -> User | None:
+        key = get_user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, USER_CACHE_TTL)
+        return user if self.user_can_authenticate(user) else None
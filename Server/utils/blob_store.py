@@ -0,0 +1,315 @@
+import hashlib
+import os
+from collections import Counter
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import BinaryIO, Iterable, Iterator
+from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from Server.backends.storage import StagedFile
+from Server.models.blob_model import Blob
+from Server.models.file_model import File
+from Server.models.share_model import Share
+from Server.utils.listing_cache import record_changes
+from Server.utils.upload_handlers import sniff_mime_type
+from Server.utils.usage import adjust_usage, charge_upload
+from Server.settings import logger, BLOB_UPLOAD_DIR, FILE_STREAM_BLOCK_SIZE
+
+
+class BulkRelease:
+    """
+    Content released by Files deleted in one batch. The references are dropped together once the batch is deleted.
+    Removals from listings are collected as well and recorded together.
+    """
+
+    def __init__(self):
+        self.blob_counts = Counter()
+        self.names = []
+        self.usage = {}
+        self.listing_changes = []
+        self.shares = []  # Tuples of the user the file was shared with and the primary key of the file
+        self.access_tokens = {}  # Access tokens of the deleted Files by their primary keys
+
+
+current_bulk_release: ContextVar[BulkRelease | None] = ContextVar('current_bulk_release', default=None)
+
+
+def get_blob_name(sha256: str) -> str:
+    """
+    Get the storage name of the blob with the given digest. Blobs are spread over two levels
+    of directories named after the first bytes of the digest, so no directory grows too large.
+    :param sha256: hex digest of the content
+    :return: string containing the name of the blob in the storage
+    """
+    return f'{BLOB_UPLOAD_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def inspect_file(source: BinaryIO, filename: str) -> tuple[str, str]:
+    """
+    Compute the SHA-256 and detect the MIME type of the file in a single read from its start,
+    in chunks of FILE_STREAM_BLOCK_SIZE bytes.
+    :param source: opened file object
+    :param filename: name of the file, used when the type cannot be detected from the content
+    :return: Tuple containing the hex digest of the content and the MIME type of the file
+    """
+    sha256 = hashlib.sha256()
+    mime_type = None
+    source.seek(0)
+    for chunk in iter(lambda: source.read(FILE_STREAM_BLOCK_SIZE), b''):
+        if mime_type is None:
+            mime_type = sniff_mime_type(chunk, filename)
+        sha256.update(chunk)
+    return sha256.hexdigest(), mime_type or sniff_mime_type(b'', filename)
+
+
+def acquire_blob(sha256: str, size: int) -> Blob:
+    """
+    Get the blob with the given digest, created if it does not exist, and add a reference to it.
+    Must be called in the transaction the referencing File is created or changed in.
+    :param sha256: hex digest of the content
+    :param size: size of the content in bytes
+    :return: Blob object
+    """
+    while True:
+        blob, created = Blob.objects.get_or_create(sha256=sha256, defaults={'size': size})
+        # The increment locks the blob row, a concurrent purge of an unreferenced blob either finished
+        # before it, in which case the row is gone and is created again, or sees the new reference.
+        if Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1):
+            return blob
+
+
+@contextmanager
+def staged_blob(content: DjangoFile, sha256: str) -> Iterator[DjangoFile]:
+    """
+    Stage the content next to its blob before the transaction it is stored in, so the database is not locked
+    while the content is copied, e.g. from a temporary directory on another file system. The staged file is
+    removed when the block ends, unless it was moved into place. Content of an existing blob is not staged,
+    neither is content that is already staged.
+    :param content: uploaded file
+    :param sha256: hex digest of the content
+    :return: file to pass to store_file within the block
+    """
+    name = get_blob_name(sha256)
+    if isinstance(content, StagedFile) or default_storage.exists(name):
+        yield content
+        return
+    with default_storage.stage(name, content) as staged:
+        yield staged
+
+
+def store_file(content: DjangoFile, sha256: str, mime_type: str, **fields) -> File:
+    """
+    Create a File for the uploaded content. The content is stored once per digest: if a blob with the same
+    content already exists, the File references it and the content is discarded, otherwise a new blob is written.
+    The content is staged with staged_blob first. Callers storing the file in a transaction of their own
+    stage it before that transaction. In the transaction, only the quota is charged, the reference count
+    of the blob is incremented, the staged content is moved into place and the File is created.
+    Size, digest and MIME type are recorded on the File, so they never have to be read from the disk again.
+    The file is counted towards the usage of its user, QuotaExceeded is raised if it does not fit into the quota.
+    :param content: uploaded file
+    :param sha256: hex digest of the content, computed while it was uploaded
+    :param mime_type: MIME type of the content, detected while it was uploaded
+    :param fields: other fields of the File, e.g. access_token, password and user
+    :return: created File object
+    """
+    with staged_blob(content, sha256) as content, transaction.atomic():
+        if fields.get('user') is not None:
+            charge_upload(fields['user'].pk, content.size)
+        blob = acquire_blob(sha256, content.size)
+
+        # Checked again once the blob is referenced, a concurrent purge may have removed the content since
+        name = get_blob_name(sha256)
+        if not default_storage.exists(name):
+            default_storage.write(name, content)
+            logger.debug(f"Stored new blob: {sha256}")
+        else:
+            logger.debug(f"Deduplicated upload against existing blob: {sha256}")
+
+        return File.objects.create(file=name, filename=os.path.basename(content.name),
+                                   blob=blob, size=content.size, sha256=sha256, mime_type=mime_type, **fields)
+
+
+def move_to_blob(file: File, sha256: str, size: int) -> bool:
+    """
+    Move the content of a File stored before blobs were introduced into the blob store, while the server is running.
+    The content is copied to the blob before the File references it and the old copy is removed once the change
+    is committed, so downloads of the File never miss the content. Content already stored as a blob is not copied.
+    If the size of the File was not recorded yet, it is counted towards the usage of its user.
+    :param file: File object without a blob
+    :param sha256: hex digest of the content
+    :param size: size of the content in bytes
+    :return: True if the File was moved, False if it was deleted or changed in the meantime
+    """
+    old_name = file.file.name
+    name = get_blob_name(sha256)
+    with transaction.atomic():
+        current = File.objects.select_for_update().filter(pk=file.pk, file=old_name, blob__isnull=True) \
+            .values_list('user_id', 'size', 'deleted_at').first()
+        if current is None:
+            return False
+        user_id, recorded_size, deleted_at = current
+        if recorded_size is None and user_id is not None:
+            # The File was counted with 0 bytes, its recorded size is released when it is deleted
+            adjust_usage(user_id, **{'bin_bytes' if deleted_at else 'live_bytes': size})
+        blob = acquire_blob(sha256, size)
+        if not default_storage.exists(name):
+            default_storage.copy(old_name, name)
+        # The original filename was only kept in the old name of files stored before filenames were recorded
+        File.objects.filter(pk=file.pk).update(file=name, blob=blob, sha256=sha256, size=size,
+                                               filename=file.get_original_filename())
+        transaction.on_commit(lambda: default_storage.remove(old_name))
+    return True
+
+
+def release_blob(blob_id: int) -> None:
+    """
+    Drop one reference to the blob. Must be called in the transaction the referencing File is deleted in.
+    The blob itself is purged after the transaction commits if it was the last reference.
+    :param blob_id: primary key of the Blob object
+    :return: None
+    """
+    bulk_release = current_bulk_release.get()
+    if bulk_release is not None:
+        bulk_release.blob_counts[blob_id] += 1
+        return
+    Blob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+    transaction.on_commit(lambda: purge_blob(blob_id))
+
+
+def release_name(name: str) -> None:
+    """
+    Remove the content owned by a deleted File stored before blobs were introduced, once the deletion is committed.
+    :param name: name of the content in the storage
+    :return: None
+    """
+    bulk_release = current_bulk_release.get()
+    if bulk_release is not None:
+        bulk_release.names.append(name)
+    else:
+        transaction.on_commit(lambda: default_storage.remove(name))
+
+
+def release_usage(user_id: int, size: int, in_bin: bool) -> None:
+    """
+    Stop counting a deleted File towards the usage of its user.
+    Must be called in the transaction the File is deleted in.
+    :param user_id: primary key of the user
+    :param size: size of the file in bytes
+    :param in_bin: whether the file was in the bin
+    :return: None
+    """
+    changes = {'bin_bytes': -size, 'bin_files': -1} if in_bin else {'live_bytes': -size, 'live_files': -1}
+    bulk_release = current_bulk_release.get()
+    if bulk_release is not None:
+        bulk_release.usage.setdefault(user_id, Counter()).update(changes)
+    else:
+        adjust_usage(user_id, **changes)
+
+
+def release_listing_entry(file: File) -> None:
+    """
+    Record the removal of a deleted File from the listing of its owner.
+    Must be called in the transaction the File is deleted in.
+    :param file: deleted File object
+    :return: None
+    """
+    change = (file.user_id, 'bin' if file.deleted_at else 'files', file.access_token)
+    bulk_release = current_bulk_release.get()
+    if bulk_release is not None:
+        bulk_release.listing_changes.append(change)
+        bulk_release.access_tokens[file.pk] = file.access_token
+    else:
+        record_changes([change])
+
+
+def release_share(share: Share) -> None:
+    """
+    Record the removal of a deleted Share from the listing of the files shared with the user.
+    In bulk, the access tokens of the files are taken from the Files deleted in the same batch or looked up
+    with one query, instead of loading the file of every Share.
+    Must be called in the transaction the Share is deleted in.
+    :param share: deleted Share object
+    :return: None
+    """
+    bulk_release = current_bulk_release.get()
+    if bulk_release is not None:
+        bulk_release.shares.append((share.shared_with_id, share.file_id))
+    else:
+        record_changes([(share.shared_with_id, 'shared', share.file.access_token)])
+
+
+@contextmanager
+def release_in_bulk() -> Iterator[BulkRelease]:
+    """
+    Collect the content released by the Files deleted in the block instead of releasing it one File at a time.
+    When the block ends, the reference counts are decremented with one update per distinct number of released
+    references and the usage counters with one update per user. Unreferenced blobs are not purged,
+    pass the collected blob ids to purge_blobs in the same transaction.
+    Removals from listings, also of deleted Shares, are recorded with one insert.
+    Names of legacy content are collected for the caller to remove after the transaction commits.
+    :return: BulkRelease collecting the released content
+    """
+    bulk_release = BulkRelease()
+    token = current_bulk_release.set(bulk_release)
+    try:
+        yield bulk_release
+    finally:
+        current_bulk_release.reset(token)
+
+    blob_ids_by_count = {}
+    for blob_id, count in bulk_release.blob_counts.items():
+        blob_ids_by_count.setdefault(count, []).append(blob_id)
+    for count, blob_ids in blob_ids_by_count.items():
+        Blob.objects.filter(pk__in=blob_ids).update(ref_count=F('ref_count') - count)
+    for user_id, changes in bulk_release.usage.items():
+        adjust_usage(user_id, **changes)
+
+    access_tokens = bulk_release.access_tokens
+    # Files deleted in the batch are gone from the database, their tokens were collected as they were deleted
+    unknown_files = {file_id for _, file_id in bulk_release.shares if file_id not in access_tokens}
+    if unknown_files:
+        access_tokens.update(File.objects.filter(pk__in=unknown_files).values_list('pk', 'access_token'))
+    record_changes(bulk_release.listing_changes + [(user_id, 'shared', access_tokens[file_id])
+                                                   for user_id, file_id in bulk_release.shares
+                                                   if file_id in access_tokens])
+
+
+def purge_blob(blob_id: int) -> None:
+    """
+    Delete the blob and its content if no File references it anymore.
+    The row is deleted conditionally before the content is removed, so a concurrent upload
+    of the same content either keeps the blob alive or writes the content again.
+    :param blob_id: primary key of the Blob object
+    :return: None
+    """
+    with transaction.atomic():
+        blob = Blob.objects.filter(pk=blob_id, ref_count__lte=0).first()
+        if blob is None or not Blob.objects.filter(pk=blob_id, ref_count__lte=0).delete()[0]:
+            return
+        default_storage.remove(get_blob_name(blob.sha256))
+        logger.debug(f"Deleted blob without references: {blob.sha256}")
+
+
+def purge_blobs(blob_ids: Iterable[int], executor: Executor) -> int:
+    """
+    Delete the blobs among the given ones that no File references anymore, with their content.
+    The rows are deleted with one conditional delete and the content is removed concurrently on the executor
+    before the transaction commits, as purge_blob does for a single blob.
+    :param blob_ids: primary keys of the Blob objects
+    :param executor: executor removing the content from the storage
+    :return: number of purged blobs
+    """
+    with transaction.atomic():
+        unreferenced = dict(Blob.objects.filter(pk__in=list(blob_ids), ref_count__lte=0).values_list('pk', 'sha256'))
+        if not unreferenced:
+            return 0
+        Blob.objects.filter(pk__in=list(unreferenced), ref_count__lte=0).delete()
+        # Blobs referenced again in the meantime were not deleted and keep their content
+        for blob_id in Blob.objects.filter(pk__in=list(unreferenced)).values_list('pk', flat=True):
+            del unreferenced[blob_id]
+        default_storage.delete_many([get_blob_name(sha256) for sha256 in unreferenced.values()], executor)
+        logger.debug(f"Deleted {len(unreferenced)} blobs without references")
+        return len(unreferenced)
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+from typing import BinaryIO
+from django.core.files import File as DjangoFile
+from Server.settings import CHUNKED_UPLOAD_DIR, FILE_STREAM_BLOCK_SIZE
+
+
+class AssembledUploadFile(DjangoFile):
+    """
+    File assembled from the chunks of a resumable upload.
+    Exposes temporary_file_path so that the storage moves the file into place instead of copying it.
+    """
+
+    def __init__(self, path: str, name: str):
+        super().__init__(open(path, 'rb'), name)
+        self.path = path
+
+    def temporary_file_path(self) -> str:
+        return self.path
+
+
+def get_partial_path(upload_id: str) -> str:
+    """
+    Get the path of the file the chunks of the upload are assembled in.
+    :param upload_id: id of the upload session
+    :return: string containing the path to the partial file
+    """
+    return os.path.join(CHUNKED_UPLOAD_DIR, upload_id)
+
+
+def create_partial_file(upload_id: str) -> None:
+    """
+    Create an empty partial file for a new upload session.
+    :param upload_id: id of the upload session
+    :return: None
+    """
+    os.makedirs(CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(get_partial_path(upload_id), 'wb').close()
+
+
+def stage_chunk(stream, length: int) -> tuple[BinaryIO, int]:
+    """
+    Read the chunk from the stream into a temporary file, before the offset of the chunk is claimed.
+    The chunk is copied in blocks of FILE_STREAM_BLOCK_SIZE bytes and never held in memory as a whole.
+    The temporary file is removed once it is closed.
+    :param stream: file-like object to read the chunk from, e.g. the request
+    :param length: number of bytes of the chunk
+    :return: tuple containing the temporary file, positioned at its start, and the number of bytes read
+    """
+    os.makedirs(CHUNKED_UPLOAD_DIR, exist_ok=True)
+    chunk_file = tempfile.TemporaryFile(dir=CHUNKED_UPLOAD_DIR)
+    written = 0
+    while written < length:
+        block = stream.read(min(FILE_STREAM_BLOCK_SIZE, length - written))
+        if not block:
+            break
+        chunk_file.write(block)
+        written += len(block)
+    chunk_file.seek(0)
+    return chunk_file, written
+
+
+def write_chunk(upload_id: str, offset: int, chunk_file: BinaryIO) -> None:
+    """
+    Write the staged chunk into the partial file at the given offset, once the offset was claimed.
+    Anything past the end of the chunk is truncated, so a retried chunk overwrites a partially written one.
+    :param upload_id: id of the upload session
+    :param offset: position in the file the chunk starts at
+    :param chunk_file: temporary file returned by stage_chunk
+    :return: None
+    """
+    with open(get_partial_path(upload_id), 'r+b') as partial_file:
+        partial_file.seek(offset)
+        shutil.copyfileobj(chunk_file, partial_file, FILE_STREAM_BLOCK_SIZE)
+        partial_file.truncate()
+
+
+def remove_partial_file(upload_id: str) -> None:
+    """
+    Remove the partial file of the upload session if it exists.
+    :param upload_id: id of the upload session
+    :return: None
+    """
+    try:
+        os.remove(get_partial_path(upload_id))
+    except FileNotFoundError:
+        pass
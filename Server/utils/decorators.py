@@ -1,26 +1,50 @@
+import inspect
+import logging
 import time
-import traceback
 from Server.settings import logger
 
 
 def response_logger(func: callable) -> callable:
     """
     Decorator to log the response time of a function.
-    It logs the function name, arguments, return value and the time taken to execute the function.
+    It logs the function name, arguments, the status of the response and the time taken to execute the function,
+    measured with the monotonic perf_counter_ns. The message is only formatted if DEBUG logging is enabled
+    and never contains the body of the response. Latency histograms of all requests are kept by MetricsMiddleware.
+    Coroutine functions are decorated with a coroutine function, so async views stay async.
     :param func: function to be decorated
     :return: decorated function
     """
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    def log_result(args, kwargs, result, started):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Function %s with arguments %r and keyword arguments %r returned %s in %.3f ms',
+                         name, args, kwargs, getattr(result, 'status_code', type(result).__name__),
+                         (time.perf_counter_ns() - started) / 1_000_000)
+
+    def log_exception(args, kwargs):
+        logger.exception('Function %s with arguments %r and keyword arguments %r threw an exception',
+                         name, args, kwargs)
+
+    if inspect.iscoroutinefunction(func):
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter_ns()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                log_exception(args, kwargs)
+                raise
+            log_result(args, kwargs, result, started)
+            return result
+        return async_wrapper
+
     def wrapper(*args, **kwargs):
-        start_time = time.time()
+        started = time.perf_counter_ns()
         try:
             result = func(*args, **kwargs)
-            end_time = time.time()
-            elapsed_time = end_time - start_time
-            logger.debug(f'Function {func.__module__}.{func.__qualname__} with arguments {args} and '
-                         f'keyword arguments {kwargs} returned {result} in {elapsed_time} seconds')
-            return result
-        except Exception as e:
-            logger.error(f'Function {func.__module__}.{func.__qualname__} with arguments {args} and '
-                         f'keyword arguments {kwargs} threw an exception: {str(e)}\n{traceback.format_exc()}')
-            raise e
+        except Exception:
+            log_exception(args, kwargs)
+            raise
+        log_result(args, kwargs, result, started)
+        return result
     return wrapper
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from django.utils.module_loading import import_string
+from Server.settings import EVENT_BUS
+
+
+class Subscription:
+    """
+    Events published to one user, received by one coroutine. Events published while the queue is full
+    are dropped, subscribers that fall behind have to catch up from the database.
+    """
+
+    def __init__(self, bus: 'EventBus', user_id: int, queue_size: int):
+        self.bus = bus
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def deliver(self, event: dict) -> None:
+        """
+        Put the event into the queue, called on the event loop of the subscriber.
+        """
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self) -> dict:
+        """
+        Wait for the next event.
+        :return: dictionary with the event
+        """
+        return await self.queue.get()
+
+    def get_pending(self) -> list[dict]:
+        """
+        Get the events that are already waiting, without waiting for more.
+        :return: list of the events
+        """
+        events = []
+        while not self.queue.empty():
+            events.append(self.queue.get_nowait())
+        return events
+
+    def close(self) -> None:
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """
+    Publishes events to the coroutines that subscribed to the events of a user.
+    Events are published from any thread, e.g. from synchronous views once their transaction commits.
+    """
+
+    def publish(self, user_id: int, event: dict) -> None:
+        """
+        Send the event to all current subscribers of the user.
+        :param user_id: primary key of the user
+        :param event: JSON serializable dictionary with the event
+        :return: None
+        """
+        raise NotImplementedError('subclasses of EventBus must provide a publish() method')
+
+    def subscribe(self, user_id: int) -> Subscription:
+        """
+        Start receiving the events of the user. Must be called on the event loop the events are received on.
+        :param user_id: primary key of the user
+        :return: Subscription to close once no more events are received
+        """
+        raise NotImplementedError('subclasses of EventBus must provide a subscribe() method')
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        raise NotImplementedError('subclasses of EventBus must provide an unsubscribe() method')
+
+
+class LocalEventBus(EventBus):
+    """
+    Events delivered within the process. Subscribers connected to other processes of the server
+    do not receive them, they notice the changes with the next heartbeat of their stream.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.subscriptions: dict[int, set[Subscription]] = {}
+        self.lock = threading.Lock()
+
+    def publish(self, user_id: int, event: dict) -> None:
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The event loop of the subscriber was closed
+                self.unsubscribe(subscription)
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(self, user_id, self.queue_size)
+        with self.lock:
+            self.subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.user_id]
+
+    def count_subscriptions(self) -> int:
+        with self.lock:
+            return sum(len(subscriptions) for subscriptions in self.subscriptions.values())
+
+
+event_bus: EventBus = import_string(EVENT_BUS['BACKEND'])(**EVENT_BUS.get('OPTIONS', {}))
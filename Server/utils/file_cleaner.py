@@ -1,63 +1,237 @@
 import aioschedule as schedule
 import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from itertools import islice
+from typing import Iterable, Iterator
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import QuerySet
 from django.utils import timezone
 from Server.models.file_model import File
-import os
-from Server.settings import logger
+from Server.models.listing_change_model import ListingChange
+from Server.models.upload_model import UploadSession
+from Server.utils.blob_store import purge_blobs, release_in_bulk
+from Server.utils.chunked_upload import remove_partial_file
+from Server.settings import logger, CLEANER_BATCH_SIZE, CLEANER_REMOVAL_WORKERS, CLEANER_GRACE_PERIOD, \
+    CLEANER_EXPIRATION_DAYS, CLEANER_UPLOAD_EXPIRATION_DAYS, LISTING_CHANGES_RETENTION_DAYS
 
+UPLOAD_DIR = 'uploads'
 
-async def delete_expired_files(expiration_days: int = 30) -> None:
+# Bounded pool removing files from the storage, the removals are I/O bound and release the GIL
+removal_executor = ThreadPoolExecutor(max_workers=CLEANER_REMOVAL_WORKERS, thread_name_prefix='cleaner')
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """
+    Split the iterable into lists of at most size items.
+    :param iterable: iterable to split
+    :param size: maximum number of items in a list
+    :return: iterator over the lists
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def get_stored_names() -> set[str]:
+    """
+    Get the names of all files referenced by the database, streamed from one query in chunks of CLEANER_BATCH_SIZE.
+    :return: set of the names
+    """
+    return set(File.objects.values_list('file', flat=True).iterator(chunk_size=CLEANER_BATCH_SIZE))
+
+
+def delete_file_rows(queryset: QuerySet, dry_run: bool = False) -> int:
+    """
+    Delete the Files selected by the queryset in batches of CLEANER_BATCH_SIZE, one transaction per batch.
+    The conditions of the queryset are checked again when a batch is deleted, Files changed after they were
+    selected, e.g. restored from the bin or moved to a blob, are kept. References to blobs are dropped per batch
+    and blobs left without references are purged in the same transaction.
+    Content of legacy files is removed concurrently once the batch is committed.
+    :param queryset: queryset selecting the Files to delete
+    :param dry_run: only count the Files that would be deleted
+    :return: number of deleted Files
+    """
+    if dry_run:
+        return queryset.count()
+    deleted = 0
+    while pks := list(queryset.values_list('pk', flat=True)[:CLEANER_BATCH_SIZE]):
+        with transaction.atomic():
+            with release_in_bulk() as released:
+                deleted += queryset.filter(pk__in=pks).delete()[1].get(File._meta.label, 0)
+            purge_blobs(released.blob_counts, removal_executor)
+        default_storage.delete_many(released.names, removal_executor)
+        logger.info(f"Deleted {deleted} files so far")
+    return deleted
+
+
+def delete_expired_files(expiration_days: int = CLEANER_EXPIRATION_DAYS, dry_run: bool = False) -> int:
     """
     Delete files that have been in the trash for more than the given number of days.
     :param expiration_days: Number of days after which the file is considered expired
-    :return: None
+    :param dry_run: only count the files that would be deleted
+    :return: number of deleted files
     """
     logger.info("Deleting expired files")
-    for file in File.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=expiration_days)):
-        os.remove(file.file.path)
-        file.delete()
+    deleted = delete_file_rows(File.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=expiration_days)),
+                               dry_run)
+    logger.info(f"Deleted {deleted} expired files")
+    return deleted
 
 
-def delete_files_not_connected_to_db() -> None:
+def delete_files_not_connected_to_db(dry_run: bool = False) -> int:
     """
     Find files that are not connected to the database. Delete them.
-    :return: None
+    The files listed by the storage are diffed against the names referenced by the database, read once.
+    Files modified within CLEANER_GRACE_PERIOD seconds are kept, they may belong to an upload in progress.
+    Blobs are kept as long as a File references them. Every batch is checked against the database again
+    before it is removed, Files may have been moved to the listed names since the names were read.
+    :param dry_run: only count the files that would be deleted
+    :return: number of deleted files
     """
     logger.info("Finding files not connected to the database")
-    for file in os.listdir("uploads"):
-        if not File.objects.filter(file=file):
-            os.remove(file)
-            logger.info(f"Found file that was not connected to the database. Deleted file: \"{file}\"")
+    stored_names = get_stored_names()
+    modified_before = time.time() - CLEANER_GRACE_PERIOD
 
+    def is_orphan(name: str) -> bool:
+        try:
+            return name not in stored_names and default_storage.get_modified_time(name).timestamp() < modified_before
+        except FileNotFoundError:
+            return False
 
-def delete_files_not_in_uploads_folder() -> None:
+    orphans = (name for name in default_storage.iter_files(UPLOAD_DIR) if is_orphan(name))
+    deleted = 0
+    for batch in batched(orphans, CLEANER_BATCH_SIZE):
+        referenced = set(File.objects.filter(file__in=batch).values_list('file', flat=True))
+        batch = [name for name in batch if name not in referenced]
+        if dry_run:
+            deleted += len(batch)
+            continue
+        for name, removed in zip(batch, removal_executor.map(default_storage.remove, batch)):
+            if removed:
+                deleted += 1
+                logger.debug(f"Found file that was not connected to the database. Deleted file: \"{name}\"")
+        logger.info(f"Deleted {deleted} files not connected to the database so far")
+    logger.info(f"Deleted {deleted} files not connected to the database")
+    return deleted
+
+
+def delete_files_not_in_uploads_folder(dry_run: bool = False) -> int:
     """
     Find files that are not in the uploads folder. Delete them.
-    :return: None
+    The names referenced by the database are diffed against the files listed by the storage, listed once.
+    Files uploaded within CLEANER_GRACE_PERIOD seconds are kept, their content may not be written yet.
+    Files are only deleted if they still reference the same name and the name is still missing from the storage,
+    they may have been moved, e.g. to a blob, since the storage was listed.
+    :param dry_run: only count the files that would be deleted
+    :return: number of deleted files
     """
     logger.info("Finding files not in the uploads folder")
-    for file in File.objects.all():
-        if not os.path.exists(file.file.path):
-            file.delete()
-            logger.info(f"Found file that was not in the uploads folder. Deleted file: \"{file.file.path}\"")
+    uploaded_before = timezone.now() - timedelta(seconds=CLEANER_GRACE_PERIOD)
+    names_in_storage = set(default_storage.iter_files(UPLOAD_DIR))
 
+    # The primary keys are collected before deleting, the rows are not changed while they are streamed
+    missing = [(pk, name) for pk, name in File.objects.filter(uploaded_at__lt=uploaded_before)
+               .values_list('pk', 'file').iterator(chunk_size=CLEANER_BATCH_SIZE) if name not in names_in_storage]
+    deleted = 0
+    for batch in batched(missing, CLEANER_BATCH_SIZE):
+        batch = [(pk, name) for pk, name in batch if not default_storage.exists(name)]
+        deleted += delete_file_rows(File.objects.filter(pk__in=[pk for pk, _ in batch],
+                                                        file__in=[name for _, name in batch]), dry_run)
+    logger.info(f"Deleted {deleted} files that were not in the uploads folder")
+    return deleted
 
-async def main():
+
+def delete_abandoned_uploads(expiration_days: int = CLEANER_UPLOAD_EXPIRATION_DAYS, dry_run: bool = False) -> int:
     """
-    Main function to run the scheduler.
+    Delete resumable uploads that have not been completed within the given number of days, with their chunks.
+    :param expiration_days: Number of days after which the upload is considered abandoned
+    :param dry_run: only count the uploads that would be deleted
+    :return: number of deleted uploads
+    """
+    logger.info("Deleting abandoned uploads")
+    abandoned = UploadSession.objects.filter(created_at__lt=timezone.now() - timedelta(days=expiration_days))
+    if dry_run:
+        return abandoned.count()
+    deleted = 0
+    while upload_ids := list(abandoned.values_list('upload_id', flat=True)[:CLEANER_BATCH_SIZE]):
+        list(removal_executor.map(remove_partial_file, upload_ids))
+        deleted += UploadSession.objects.filter(upload_id__in=upload_ids).delete()[0]
+    logger.info(f"Deleted {deleted} abandoned uploads")
+    return deleted
+
+
+def delete_old_listing_changes(retention_days: int = LISTING_CHANGES_RETENTION_DAYS, dry_run: bool = False) -> int:
+    """
+    Delete the listing changes recorded more than the given number of days ago. Clients that last synced
+    before the oldest kept change reload their listings. The newest change is always kept, so versions
+    of the listings never go back and primary keys are not reused.
+    :param retention_days: Number of days for which changes are kept
+    :param dry_run: only count the changes that would be deleted
+    :return: number of deleted changes
+    """
+    logger.info("Deleting old listing changes")
+    newest_pk = ListingChange.objects.order_by('-pk').values_list('pk', flat=True).first()
+    old_changes = ListingChange.objects.filter(changed_at__lt=timezone.now() - timedelta(days=retention_days)) \
+        .exclude(pk=newest_pk).order_by('pk')
+    if dry_run:
+        return old_changes.count()
+    deleted = 0
+    while pks := list(old_changes.values_list('pk', flat=True)[:CLEANER_BATCH_SIZE]):
+        deleted += ListingChange.objects.filter(pk__in=pks).delete()[0]
+    logger.info(f"Deleted {deleted} old listing changes")
+    return deleted
+
+
+CLEANUPS = {
+    'expired_files': delete_expired_files,
+    'files_not_connected_to_db': delete_files_not_connected_to_db,
+    'files_not_in_uploads_folder': delete_files_not_in_uploads_folder,
+    'abandoned_uploads': delete_abandoned_uploads,
+    'old_listing_changes': delete_old_listing_changes,
+}
+
+
+def run_cleanup(name: str, dry_run: bool = False) -> int:
+    """
+    Run the cleanup with the given name and log how much it deleted and how long it took.
+    :param name: name of the cleanup, a key of CLEANUPS
+    :param dry_run: only count what would be deleted
+    :return: number of deleted items
+    """
+    started = time.perf_counter()
+    try:
+        deleted = CLEANUPS[name](dry_run=dry_run)
+    except Exception:
+        logger.exception(f"Cleanup {name} failed after {time.perf_counter() - started:.1f} s")
+        raise
+    logger.info(f"Cleanup {name} {'would delete' if dry_run else 'deleted'} {deleted} items "
+                f"in {time.perf_counter() - started:.1f} s")
+    return deleted
+
+
+async def main(schedules: dict[str, str], dry_run: bool = False):
+    """
+    Main function to run the scheduler. Every cleanup runs daily at the time given in schedules.
+    The cleanups use the synchronous ORM and run in a thread, one at a time.
+    :param schedules: dictionary of the time of day, e.g. '00:00', by the name of the cleanup
+    :param dry_run: only count what would be deleted
     """
     logger.info("Starting scheduler")
-    schedule.every(1).days.at("00:00").do(delete_expired_files)
-    schedule.every(1).days.at("00:00").do(delete_files_not_connected_to_db)
-    schedule.every(1).days.at("00:00").do(delete_files_not_in_uploads_folder)
 
-    while True:
-        logger.debug("Running scheduler")
-        await schedule.run_pending()
-        await asyncio.sleep(60 * 60)
+    async def run_scheduled_cleanup(name: str) -> None:
+        try:
+            await asyncio.to_thread(run_cleanup, name, dry_run)
+        except Exception:
+            pass  # Logged by run_cleanup, the cleanup runs again at its next time
 
+    for name, at in schedules.items():
+        schedule.every(1).days.at(at).do(run_scheduled_cleanup, name)
 
-if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    while True:
+        logger.debug("Running scheduler")
+        for job in sorted(job for job in schedule.jobs if job.should_run):
+            await job.run()
+        await asyncio.sleep(60)
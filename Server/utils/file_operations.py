@@ -1,70 +1,112 @@
-import io
 import os
-import subprocess
 import tarfile
+import time
 import uuid
-from io import BytesIO
-from time import sleep
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterator
+import pyzipper
+from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
 from Server.models.file_model import File
-from Server.settings import logger
+from Server.settings import logger, FILE_STREAM_BLOCK_SIZE, ARCHIVE_COMPRESSION_WORKERS, \
+    ARCHIVE_COMPRESSION_BLOCK_SIZE
 
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+ZIP_MIN_DATE = (1980, 1, 1, 0, 0, 0)  # the earliest date a zip archive can hold
 
-def encrypt_file(path: str, password: str) -> tuple[BytesIO, str] | tuple[None, None]:
+compression_executor = ThreadPoolExecutor(max_workers=ARCHIVE_COMPRESSION_WORKERS,
+                                          thread_name_prefix='archive-compression')
+
+
+class StreamBuffer:
+    """
+    Write-only, non-seekable file-like object that keeps the written bytes until they are drained.
+    Archive writers write into it and the written bytes are passed on to the response chunk by chunk.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def encrypt_file(name: str, filename: str, password: str) -> Iterator[bytes] | None:
     """
-    Encrypt the file with the given password. The file is zipped and encrypted with the given password.
-    :param path: string containing the path to the file
+    Encrypt the file with the given password. The file is zipped and encrypted with AES-256 in process.
+    The archive is produced chunk by chunk while the file is read, nothing is written to the disk
+    and at most one chunk of the file is held in memory.
+    :param name: string containing the name of the file in the storage
+    :param filename: original filename, the name of the file inside the archive
     :param password: string containing the password
-    :return: Tuple containing the encrypted file in BytesIO format and the path to the encrypted file
+    :return: Iterator over the bytes of the encrypted zip archive, None if the file does not exist
     """
-    path = zip_file_with_password(path, password)
-    try:
-        with open(path, 'rb') as f:
-            encrypted_file = io.BytesIO(f.read())
-            return encrypted_file, path
-    except FileNotFoundError as e:
-        print(e)
-        return None, None
+    source = open_stored_file(name)
+    if source is None:
+        logger.error(f"Could not encrypt file, not found in the storage: {name}")
+        return None
+    return zip_file_with_password(source, filename, get_modified_time(name), password)
 
 
-def zip_file_with_password(source_path: str, password: str) -> str | None:
+def zip_file_with_password(source: DjangoFile, arcname: str, modified_time: float, password: str) -> Iterator[bytes]:
     """
-    Zip the file with the given password. The file is zipped with the given password.
-    Only works on Unix systems.
-    :param source_path: string containing the path to the file
+    Zip the opened file with the given password. The entry is deflated and encrypted with WinZip AES-256.
+    The source file is closed once the archive is complete or the iteration is abandoned.
+    :param source: opened file object to zip
+    :param arcname: name of the file inside the archive
+    :param modified_time: timestamp of the last modification of the file
     :param password: string containing the password
-    :return: string containing the path to the zipped file
+    :return: Iterator over the bytes of the encrypted zip archive
     """
-    zip_filename = os.path.basename(source_path) + '.zip'
-    non_secured_filename = os.path.basename(source_path)
-    current_dir = os.getcwd()
-    os.chdir(os.path.dirname(source_path))
+    buffer = StreamBuffer()
+    with source:
+        with pyzipper.AESZipFile(buffer, 'w', compression=pyzipper.ZIP_DEFLATED,
+                                 encryption=pyzipper.WZ_AES) as archive:
+            archive.setpassword(password.encode())
+            entry_info = archive.zipinfo_cls(arcname, date_time=time.localtime(modified_time)[:6])
+            entry_info.compress_type = pyzipper.ZIP_DEFLATED
+            entry_info.file_size = source.size
+            with archive.open(entry_info, 'w') as entry:
+                for chunk in iter(lambda: source.read(FILE_STREAM_BLOCK_SIZE), b''):
+                    entry.write(chunk)
+                    if data := buffer.drain():
+                        yield data
+        logger.debug(f"Zipped file with password: {arcname}")
+    yield buffer.drain()
 
-    zip_command = ["7z", "a", f"-p{password}", zip_filename, non_secured_filename]
 
+def open_stored_file(name: str) -> DjangoFile | None:
+    """
+    Open the file with the given name in the storage for streaming. The content is not read into memory,
+    the opened file is seekable. The caller is responsible for closing the returned file object.
+    :param name: Name of the file in the storage
+    :return: Opened file object, None if the file does not exist
+    """
     try:
-        subprocess.run(zip_command, check=True, cwd=os.path.dirname(source_path))
-        logger.debug(f"Zipped file with password: {zip_filename}")
-        while not os.path.exists(zip_filename):
-            sleep(0.1)
-        path_to_zipfile = os.path.abspath(zip_filename)
-        os.chdir(current_dir)
-        return path_to_zipfile
-    except subprocess.CalledProcessError as e:
-        print(e)
+        return default_storage.open(name, 'rb')
+    except FileNotFoundError:
         return None
 
 
-def get_file_from_path(file_path: str) -> (str, bytes):
+def get_modified_time(name: str) -> float:
     """
-    Get the file content from the given file path.
-    :param file_path: Path to the file
-    :return: Tuple containing the file name as string and the file content in bytes
+    Get the time of the last modification of the file with the given name in the storage.
+    :param name: Name of the file in the storage
+    :return: timestamp of the modification
     """
-    if os.path.exists(file_path):
-        with open(file_path, 'rb') as f:
-            return os.path.basename(file_path), f.read()
-    else:
-        return None
+    return default_storage.get_modified_time(name).timestamp()
 
 
 def generate_unique_access_token() -> str:
@@ -77,22 +119,170 @@ def generate_unique_access_token() -> str:
     return uuid.uuid4().hex
 
 
-def create_tarfile_in_memory(files: list) -> io.BytesIO:
+def read_exactly(source: BinaryIO, size: int) -> Iterator[bytes]:
     """
-    Create a tarfile in memory from a list of files.
-    :param files: list of files
-    :return: tar file that contains the files
+    Read exactly size bytes from the file in chunks of FILE_STREAM_BLOCK_SIZE bytes.
+    If the file turns out to be shorter, the missing bytes are filled with zeros so that archive headers stay valid.
+    :param source: opened file object
+    :param size: number of bytes to read
+    :return: iterator over the chunks
     """
-    tar_data = io.BytesIO()
-    try:
-        with tarfile.open(fileobj=tar_data, mode='w:gz') as tar:
-            for file in files:
-                try:
-                    if os.path.isfile(file):
-                        tar.add(file, arcname=os.path.basename(file))
-                except FileNotFoundError as e:
-                    print(e)
-    except tarfile.TarError as e:
-        print(e)
-    tar_data.seek(0)
-    return tar_data
+    remaining = size
+    while remaining > 0:
+        chunk_size = min(FILE_STREAM_BLOCK_SIZE, remaining)
+        chunk = source.read(chunk_size) or b'\0' * chunk_size
+        remaining -= len(chunk)
+        yield chunk
+
+
+def stream_tarfile(files: list[tuple[str, str]]) -> Iterator[bytes]:
+    """
+    Create an uncompressed tar archive from a list of files, member by member.
+    Each member is emitted while it is read, so memory usage does not depend on the size of the files.
+    Files that do not exist are skipped.
+    :param files: list of tuples containing the name of the file in the storage and its name inside the archive
+    :return: iterator over the bytes of the tar archive
+    """
+    written = 0
+    for name, arcname in files:
+        source = open_stored_file(name)
+        if source is None:
+            logger.error(f"Skipping file missing from the archive: {name}")
+            continue
+        with source:
+            tar_info = tarfile.TarInfo(arcname)
+            tar_info.size = source.size
+            tar_info.mtime = int(get_modified_time(name))
+            header = tar_info.tobuf(format=tarfile.PAX_FORMAT)
+            yield header
+            yield from read_exactly(source, tar_info.size)
+            padding = -tar_info.size % tarfile.BLOCKSIZE
+            yield tarfile.NUL * padding
+            written += len(header) + tar_info.size + padding
+
+    end_of_archive = 2 * tarfile.BLOCKSIZE
+    yield tarfile.NUL * (end_of_archive + -(written + end_of_archive) % tarfile.RECORDSIZE)
+
+
+def gzip_stream(chunks: Iterator[bytes], compression_level: int) -> Iterator[bytes]:
+    """
+    Compress the stream of bytes into the gzip format on the fly.
+    :param chunks: iterator over the bytes to compress
+    :param compression_level: zlib compression level from 1 (fastest) to 9 (smallest)
+    :return: iterator over the compressed bytes
+    """
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
+
+
+def gzip_member(data: bytes, compression_level: int) -> bytes:
+    """
+    Compress the data into a complete, standalone gzip member.
+    :param data: bytes to compress
+    :param compression_level: zlib compression level from 1 (fastest) to 9 (smallest)
+    :return: gzip member containing the data
+    """
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def parallel_gzip_stream(chunks: Iterator[bytes], compression_level: int) -> Iterator[bytes]:
+    """
+    Compress the stream of bytes into the gzip format using all cores.
+    The stream is cut into blocks of ARCHIVE_COMPRESSION_BLOCK_SIZE bytes and every block is compressed
+    into its own gzip member on the shared compression pool (zlib releases the GIL while compressing).
+    Concatenated members form a standard gzip file. At most two blocks per worker are in flight,
+    so memory usage stays bounded while the members are emitted in order.
+    :param chunks: iterator over the bytes to compress
+    :param compression_level: zlib compression level from 1 (fastest) to 9 (smallest)
+    :return: iterator over the compressed bytes
+    """
+    pending = deque()
+    block = bytearray()
+    for chunk in chunks:
+        block += chunk
+        if len(block) < ARCHIVE_COMPRESSION_BLOCK_SIZE:
+            continue
+        pending.append(compression_executor.submit(gzip_member, bytes(block), compression_level))
+        block.clear()
+        if len(pending) >= 2 * ARCHIVE_COMPRESSION_WORKERS:
+            yield pending.popleft().result()
+    if block or not pending:
+        pending.append(compression_executor.submit(gzip_member, bytes(block), compression_level))
+    while pending:
+        yield pending.popleft().result()
+
+
+def stream_zipfile(files: list[tuple[str, str]], compression_level: int) -> Iterator[bytes]:
+    """
+    Create a zip archive from a list of files, chunk by chunk. Level 0 stores the files without compression,
+    which is the fastest choice for files that are already compressed. Files that do not exist are skipped.
+    :param files: list of tuples containing the name of the file in the storage and its name inside the archive
+    :param compression_level: compression level from 0 (store) to 9 (smallest)
+    :return: iterator over the bytes of the zip archive
+    """
+    compression = zipfile.ZIP_DEFLATED if compression_level else zipfile.ZIP_STORED
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=compression, compresslevel=compression_level or None) as archive:
+        for name, arcname in files:
+            source = open_stored_file(name)
+            if source is None:
+                logger.error(f"Skipping file missing from the archive: {name}")
+                continue
+            with source:
+                size = source.size
+                zip_info = zipfile.ZipInfo(arcname, date_time=max(time.localtime(get_modified_time(name))[:6],
+                                                                  ZIP_MIN_DATE))
+                zip_info.compress_type = compression
+                zip_info.file_size = size
+                with archive.open(zip_info, 'w') as entry:
+                    for chunk in read_exactly(source, size):
+                        entry.write(chunk)
+                        if data := buffer.drain():
+                            yield data
+    yield buffer.drain()
+
+
+def get_unique_arcnames(arcnames: list[str]) -> list[str]:
+    """
+    Make the names of the members of an archive unique, files with the same name would overwrite each other
+    when the archive is extracted. Repeated names are numbered as 'report (1).pdf', 'report (2).pdf', ...,
+    skipping names that are taken by other files.
+    :param arcnames: list of the names of the files inside the archive
+    :return: list of unique names in the same order
+    """
+    taken = set(arcnames)
+    seen = set()
+    unique_arcnames = []
+    for arcname in arcnames:
+        if arcname in seen:
+            stem, extension = os.path.splitext(arcname)
+            number = 1
+            while f'{stem} ({number}){extension}' in taken:
+                number += 1
+            arcname = f'{stem} ({number}){extension}'
+            taken.add(arcname)
+        seen.add(arcname)
+        unique_arcnames.append(arcname)
+    return unique_arcnames
+
+
+def stream_archive(files: list[tuple[str, str]], archive_format: str, compression_level: int) -> Iterator[bytes]:
+    """
+    Create an archive of the given format from a list of files, streamed chunk by chunk.
+    :param files: list of tuples containing the name of the file in the storage and its name inside the archive
+    :param archive_format: 'tar' for a tar archive, gzipped unless the level is 0, or 'zip' for a zip archive
+    :param compression_level: compression level from 0 (store) to 9 (smallest)
+    :return: iterator over the bytes of the archive
+    """
+    files = list(zip([name for name, _ in files], get_unique_arcnames([arcname for _, arcname in files])))
+    if archive_format == 'zip':
+        return stream_zipfile(files, compression_level)
+    if compression_level and ARCHIVE_COMPRESSION_WORKERS > 1:
+        return parallel_gzip_stream(stream_tarfile(files), compression_level)
+    if compression_level:
+        return gzip_stream(stream_tarfile(files), compression_level)
+    return stream_tarfile(files)
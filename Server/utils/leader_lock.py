@@ -0,0 +1,68 @@
+import os
+from typing import BinaryIO
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class LockNotAcquired(Exception):
+    """
+    Raised when the lock is held by another process.
+    """
+
+
+class LeaderLock:
+    """
+    Exclusive lock on a file, held by at most one process on the host. The operating system releases the lock
+    when the process exits, so a crashed leader never blocks its successor.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_file: BinaryIO | None = None
+
+    def acquire(self) -> None:
+        """
+        Acquire the lock without waiting and write the id of the process into the file.
+        :return: None
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        lock_file = open(self.path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            raise LockNotAcquired(f'Lock {self.path} is held by another process')
+        lock_file.truncate(0)
+        lock_file.write(str(os.getpid()).encode())
+        lock_file.flush()
+        self.lock_file = lock_file
+
+    def release(self) -> None:
+        """
+        Release the lock.
+        :return: None
+        """
+        if self.lock_file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        else:
+            self.lock_file.seek(0)
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.lock_file.close()
+        self.lock_file = None
+
+    def __enter__(self) -> 'LeaderLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
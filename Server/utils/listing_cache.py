@@ -0,0 +1,112 @@
+import functools
+import hashlib
+from typing import Iterable
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from Server.models.listing_change_model import ListingChange
+from Server.utils.event_bus import event_bus
+from Server.settings import LISTING_CACHE_TTL, LISTING_VERSION_TTL
+
+LISTINGS = ('files', 'bin', 'shared')
+
+
+def get_version_key(user_id: int) -> str:
+    """
+    Get the key under which the version of the listings of the user is cached.
+    :param user_id: primary key of the user
+    :return: string containing the cache key
+    """
+    return f'listing-version:{user_id}'
+
+
+def record_changes(changes: Iterable[tuple[int, str, str]]) -> None:
+    """
+    Record that files were added to, changed in or removed from listings. Must be called in the transaction
+    the files are changed in. The cached versions of the users are dropped once the transaction commits,
+    so the snapshots of older versions are no longer served, and the event streams of the users are woken up.
+    :param changes: tuples containing the primary key of the user, the name of the listing and the file token
+    :return: None
+    """
+    rows = [ListingChange(user_id=user_id, listing=listing, access_token=access_token)
+            for user_id, listing, access_token in changes]
+    if not rows:
+        return
+    ListingChange.objects.bulk_create(rows)
+    user_ids = {row.user_id for row in rows}
+
+    def notify() -> None:
+        cache.delete_many([get_version_key(user_id) for user_id in user_ids])
+        for user_id in user_ids:
+            event_bus.publish(user_id, {'listings': sorted({row.listing for row in rows if row.user_id == user_id})})
+
+    transaction.on_commit(notify)
+
+
+async def aget_listing_version(user_id: int) -> int:
+    """
+    Get the version of the listings of the user, the primary key of their latest change.
+    The version is cached for LISTING_VERSION_TTL seconds. Once changes of the user were pruned, the version
+    is no lower than the oldest change kept, so it never goes back to a version a client has seen before.
+    :param user_id: primary key of the user
+    :return: version of the listings
+    """
+    key = get_version_key(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        latest = await ListingChange.objects.filter(user_id=user_id).order_by('-pk').values_list('pk', flat=True) \
+            .afirst()
+        oldest = await ListingChange.objects.order_by('pk').values_list('pk', flat=True).afirst()
+        version = max(latest or 0, (oldest or 1) - 1)
+        await cache.aset(key, version, LISTING_VERSION_TTL)
+    return version
+
+
+def get_snapshot_key(user_id: int, listing: str, version: int, request: WSGIRequest) -> str:
+    """
+    Get the key under which the serialized listing of the user is cached. Every page, order and filter
+    of the listing is cached separately.
+    """
+    params = hashlib.sha256(request.GET.urlencode().encode()).hexdigest()
+    return f'listing:{user_id}:{listing}:{version}:{params}'
+
+
+def cached_listing(listing: str):
+    """
+    Decorator for asynchronous listing views. Responses of authenticated users are cached with the version
+    of their listings and sent again until one of their files or shares changes. Clients sending
+    the ETag of the current version receive 304 without a body, which costs no database query
+    while the version is cached. The version is sent in the 'Listing-Version' header, changes
+    since then are returned by the listing changes view.
+    :param listing: name of the listing, one of LISTINGS
+    :return: decorator
+    """
+    def decorator(func: callable) -> callable:
+        @functools.wraps(func)
+        async def wrapper(request: WSGIRequest, *args, **kwargs) -> HttpResponse:
+            user = await request.auser()
+            if not user.is_authenticated:
+                return await func(request, *args, **kwargs)
+
+            version = await aget_listing_version(user.pk)
+            etag = quote_etag(f'{listing}-{version}')
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                key = get_snapshot_key(user.pk, listing, version, request)
+                content = await cache.aget(key)
+                if content is not None:
+                    response = HttpResponse(content, content_type='application/json')
+                else:
+                    response = await func(request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    await cache.aset(key, response.content, LISTING_CACHE_TTL)
+            response['ETag'] = etag
+            response['Listing-Version'] = version
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,183 @@
+import json
+from datetime import datetime
+from django.core.files.storage import default_storage
+from django.db.models import F, Q, QuerySet, Value
+from django.db.models.functions import Coalesce
+from django.http import QueryDict
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from Server.settings import LISTING_DEFAULT_SORT, LISTING_MAX_PAGE_SIZE
+
+# Expressions listings can be ordered by, files without a recorded size are listed as empty
+FILE_SORT_KEYS = {'name': F('filename'), 'size': Coalesce('size', Value(0)), 'date': F('uploaded_at')}
+SHARE_SORT_KEYS = {'name': F('file__filename'), 'size': Coalesce('file__size', Value(0)), 'date': F('shared_at')}
+
+# Columns of the rows of the listings of a user, turned into entries by the functions below
+FILE_COLUMNS = ['access_token', 'file', 'filename']
+BIN_COLUMNS = ['access_token', 'file', 'filename', 'size']
+SHARE_COLUMNS = ['file__access_token', 'file__file', 'file__filename', 'file__size', 'shared_by__username']
+
+
+def get_listed_filename(name: str, filename: str) -> str:
+    """
+    Get the original filename of a file listed with values(), same as File.get_original_filename.
+    :param name: name of the file in the storage
+    :param filename: original filename recorded at upload time, empty for older files
+    :return: string containing the original filename
+    """
+    return filename or name.split('/')[-1]
+
+
+def get_listed_size(name: str, size: int | None) -> int:
+    """
+    Get the size of a file listed with values(), same as File.get_size.
+    The disk is only consulted for files uploaded before sizes were recorded.
+    :param name: name of the file in the storage
+    :param size: size recorded at upload time, None for older files
+    :return: size of the file in bytes
+    """
+    return size if size is not None else default_storage.size(name)
+
+
+def get_file_entry(access_token: str, name: str, filename: str) -> dict:
+    """
+    Get the entry of a file uploaded by the user from a row with the FILE_COLUMNS.
+    """
+    return {'file_token': access_token, 'filename': get_listed_filename(name, filename)}
+
+
+def get_bin_entry(access_token: str, name: str, filename: str, size: int | None) -> dict:
+    """
+    Get the entry of a file in the bin from a row with the BIN_COLUMNS.
+    """
+    return {'file_token': access_token,
+            'filename': get_listed_filename(name, filename),
+            'file_size': get_listed_size(name, size)}
+
+
+def get_share_entry(access_token: str, name: str, filename: str, size: int | None, owner: str) -> dict:
+    """
+    Get the entry of a file shared with the user from a row with the SHARE_COLUMNS.
+    """
+    return {'file_token': access_token,
+            'filename': get_listed_filename(name, filename),
+            'file_size': get_listed_size(name, size),
+            'owner': owner}
+
+
+class ListingError(ValueError):
+    """
+    Raised when the sorting, filtering or pagination parameters of a listing are invalid.
+    """
+
+
+def encode_cursor(sort: str, value, pk: int) -> str:
+    """
+    Encode the position after the given row into an opaque cursor.
+    :param sort: sort parameter the listing was requested with
+    :param value: sort key of the last row of the page
+    :param pk: primary key of the last row of the page
+    :return: string containing the cursor
+    """
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return urlsafe_base64_encode(json.dumps([sort, value, pk]).encode())
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """
+    Decode the cursor created by encode_cursor.
+    :param cursor: string containing the cursor
+    :param sort: sort parameter the listing is requested with, must be the one the cursor was created with
+    :return: Tuple containing the sort key and the primary key of the last row of the previous page
+    """
+    try:
+        cursor_sort, value, pk = json.loads(urlsafe_base64_decode(cursor))
+    except (ValueError, TypeError):
+        raise ListingError('Invalid cursor')
+    if cursor_sort != sort:
+        raise ListingError('Cursor does not match the sort order')
+    # Cursors come from clients, values of the wrong type must not reach the query
+    value_type = int if sort.lstrip('-') == 'size' else str
+    if type(pk) is not int or type(value) is not value_type:
+        raise ListingError('Invalid cursor')
+    if sort.lstrip('-') == 'date':
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            raise ListingError('Invalid cursor')
+    return value, pk
+
+
+def get_listing_query(queryset: QuerySet, params: QueryDict, sort_keys: dict, prefix_field: str,
+                      columns: list[str]) -> tuple[QuerySet, str, int | None]:
+    """
+    Build the query of one page of a listing using keyset pagination. The query parameters of the request select
+    the page: 'sort' is one of the keys of sort_keys, prefixed with '-' for descending order, 'prefix' filters rows
+    whose name starts with the given string, 'limit' is the number of rows and 'cursor' is the cursor returned
+    with the previous page. Without 'limit' all rows are returned.
+    Rows are ordered by the sort key and the primary key, so pages are stable and each page is fetched
+    with an index range scan instead of an offset.
+    :param queryset: queryset of all rows of the listing
+    :param params: query parameters of the request
+    :param sort_keys: mapping of sort parameters to the expressions the rows are ordered by
+    :param prefix_field: field filtered by the 'prefix' parameter
+    :param columns: columns of the rows to return
+    :return: Tuple containing the query of the rows, the sort parameter and the limit, pass them to split_page
+    """
+    sort = params.get('sort', LISTING_DEFAULT_SORT)
+    descending = sort.startswith('-')
+    if sort.lstrip('-') not in sort_keys:
+        raise ListingError(f'Invalid sort, expected one of: {", ".join(sort_keys)}')
+    limit = params.get('limit')
+    if limit is not None and (not limit.isdigit() or not 0 < int(limit) <= LISTING_MAX_PAGE_SIZE):
+        raise ListingError(f'Invalid limit, expected a number from 1 to {LISTING_MAX_PAGE_SIZE}')
+
+    queryset = queryset.annotate(sort_key=sort_keys[sort.lstrip('-')])
+    if prefix := params.get('prefix'):
+        queryset = queryset.filter(**{f'{prefix_field}__startswith': prefix})
+    if cursor := params.get('cursor'):
+        value, pk = decode_cursor(cursor, sort)
+        if descending:
+            queryset = queryset.filter(Q(sort_key__lt=value) | Q(sort_key=value, pk__lt=pk))
+        else:
+            queryset = queryset.filter(Q(sort_key__gt=value) | Q(sort_key=value, pk__gt=pk))
+
+    queryset = queryset.order_by('-sort_key', '-pk') if descending else queryset.order_by('sort_key', 'pk')
+    rows = queryset.values_list(*columns, 'sort_key', 'pk')
+    if limit is None:
+        return rows, sort, None
+    return rows[:int(limit) + 1], sort, int(limit)
+
+
+def split_page(rows: list[tuple], sort: str, limit: int | None) -> tuple[list[tuple], str | None]:
+    """
+    Split the rows fetched by the query of get_listing_query into the page and the cursor of the next page.
+    :param rows: rows fetched by the query
+    :param sort: sort parameter returned by get_listing_query
+    :param limit: limit returned by get_listing_query
+    :return: Tuple containing the rows of the page and the cursor of the next page, None if it is the last page
+    """
+    if limit is None:
+        return [row[:-2] for row in rows], None
+    next_cursor = encode_cursor(sort, *rows[limit - 1][-2:]) if len(rows) > limit else None
+    return [row[:-2] for row in rows[:limit]], next_cursor
+
+
+def get_listing_page(queryset: QuerySet, params: QueryDict, sort_keys: dict, prefix_field: str,
+                     columns: list[str]) -> tuple[list[tuple], str | None]:
+    """
+    Get one page of a listing, see get_listing_query for the query parameters.
+    :return: Tuple containing the rows of the page and the cursor of the next page, None if it is the last page
+    """
+    rows, sort, limit = get_listing_query(queryset, params, sort_keys, prefix_field, columns)
+    return split_page(list(rows), sort, limit)
+
+
+async def aget_listing_page(queryset: QuerySet, params: QueryDict, sort_keys: dict, prefix_field: str,
+                            columns: list[str]) -> tuple[list[tuple], str | None]:
+    """
+    Asynchronous version of get_listing_page.
+    :return: Tuple containing the rows of the page and the cursor of the next page, None if it is the last page
+    """
+    rows, sort, limit = get_listing_query(queryset, params, sort_keys, prefix_field, columns)
+    return split_page([row async for row in rows], sort, limit)
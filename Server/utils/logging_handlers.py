@@ -0,0 +1,34 @@
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Filter letting through all records of severity INFO and above and a random sample of DEBUG records.
+    """
+
+    def __init__(self, debug_sample_rate: float):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.debug_sample_rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Handler putting records on a bounded queue without waiting. When the queue is full, because the disk
+    cannot keep up, records are dropped and counted instead of blocking the thread that logs them.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import AsyncIterator, Iterator
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpRequest, HttpResponse
+from Server.settings import queue_handler
+
+# Upper bounds of the latency histogram buckets in milliseconds, the last bucket is unbounded
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+LATENCY_BUCKETS_NS = tuple(int(bound * 1_000_000) for bound in LATENCY_BUCKETS_MS)
+
+
+class EndpointMetrics:
+    """
+    Counters of the requests of one endpoint and method.
+    """
+    __slots__ = ('requests', 'statuses', 'latency_buckets', 'latency_sum_ns', 'bytes_sent')
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS_NS) + 1)
+        self.latency_sum_ns = 0
+        self.bytes_sent = 0
+
+    def snapshot(self) -> dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip((*map(str, LATENCY_BUCKETS_MS), '+Inf'), self.latency_buckets):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {'requests': self.requests,
+                'statuses': dict(self.statuses),
+                'latency_ms': {'buckets': buckets, 'sum': self.latency_sum_ns / 1_000_000},
+                'bytes_sent': self.bytes_sent}
+
+
+class MetricsRegistry:
+    """
+    Latency histograms, status counts and bytes sent per endpoint and method, kept in the memory of the process.
+    Updates take a lock for a few integer increments, nothing is formatted until a snapshot is requested.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.started_at = time.time()
+
+    def get_endpoint(self, key: tuple[str, str]) -> EndpointMetrics:
+        metrics = self.endpoints.get(key)
+        if metrics is None:
+            metrics = self.endpoints.setdefault(key, EndpointMetrics())
+        return metrics
+
+    def record_request(self, key: tuple[str, str], status: int, elapsed_ns: int) -> None:
+        """
+        Record a request that was answered.
+        :param key: Tuple containing the name of the endpoint and the method of the request
+        :param status: status code of the response
+        :param elapsed_ns: nanoseconds until the response was returned by the view, without streaming its body
+        :return: None
+        """
+        with self.lock:
+            metrics = self.get_endpoint(key)
+            metrics.requests += 1
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.latency_buckets[bisect_left(LATENCY_BUCKETS_NS, elapsed_ns)] += 1
+            metrics.latency_sum_ns += elapsed_ns
+
+    def record_bytes(self, key: tuple[str, str], count: int) -> None:
+        """
+        Record the bytes of a response body that were sent.
+        :param key: Tuple containing the name of the endpoint and the method of the request
+        :param count: number of bytes
+        :return: None
+        """
+        with self.lock:
+            self.get_endpoint(key).bytes_sent += count
+
+    def snapshot(self) -> dict:
+        """
+        Get the current values of all metrics.
+        :return: dictionary of the metrics of every method by the names of the endpoints
+        """
+        with self.lock:
+            endpoints = {}
+            for (endpoint, method), metrics in sorted(self.endpoints.items()):
+                endpoints.setdefault(endpoint, {})[method] = metrics.snapshot()
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started_at,
+                'log_records_dropped': queue_handler.dropped, 'endpoints': endpoints}
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """
+    Middleware recording the latency, status and bytes sent of every request in the registry.
+    Latency is measured with the monotonic perf_counter_ns until the view returns the response. The bytes
+    of streamed bodies are counted while they are sent, unless the length of the body is known up front.
+    Requests are grouped by the name of the URL pattern they matched.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: callable):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter_ns()
+        response = self.get_response(request)
+        return self.record(request, response, time.perf_counter_ns() - started)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        started = time.perf_counter_ns()
+        response = await self.get_response(request)
+        return self.record(request, response, time.perf_counter_ns() - started)
+
+    @staticmethod
+    def record(request: HttpRequest, response: HttpResponse, elapsed_ns: int) -> HttpResponse:
+        resolver_match = request.resolver_match
+        key = (resolver_match.url_name or resolver_match.view_name if resolver_match else 'unmatched',
+               request.method)
+        registry.record_request(key, response.status_code, elapsed_ns)
+
+        if not response.streaming:
+            registry.record_bytes(key, len(response.content))
+        elif response.has_header('Content-Length'):
+            # Known length, the body is not wrapped so FileResponse can still be sent with the file wrapper
+            registry.record_bytes(key, int(response['Content-Length']))
+        elif response.is_async:
+            response.streaming_content = count_bytes_async(response.streaming_content, key)
+        else:
+            response.streaming_content = count_bytes(response.streaming_content, key)
+        return response
+
+
+def count_bytes(chunks: Iterator[bytes], key: tuple[str, str]) -> Iterator[bytes]:
+    """
+    Pass the chunks of a streamed body through and record how many bytes were sent once it is finished.
+    """
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        registry.record_bytes(key, sent)
+
+
+async def count_bytes_async(chunks: AsyncIterator[bytes], key: tuple[str, str]) -> AsyncIterator[bytes]:
+    """
+    Asynchronous version of count_bytes.
+    """
+    sent = 0
+    try:
+        async for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        registry.record_bytes(key, sent)
@@ -0,0 +1,266 @@
+import asyncio
+import re
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, BinaryIO, Iterator
+from django.core.handlers.asgi import ASGIRequest
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+from Server.settings import FILE_STREAM_BLOCK_SIZE, MAX_RANGES_PER_REQUEST
+
+RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def stream_file_response(content: BinaryIO, filename: str) -> FileResponse:
+    """
+    Create a response that streams the given file to the client in chunks of FILE_STREAM_BLOCK_SIZE bytes.
+    Content-Length and Content-Disposition headers are set from the file. The file is closed when the response is.
+    :param content: opened file object to stream
+    :param filename: name of the file presented to the client
+    :return: FileResponse streaming the file
+    """
+    response = FileResponse(content, as_attachment=True, filename=filename,
+                            content_type='application/force-download')
+    response.block_size = FILE_STREAM_BLOCK_SIZE
+    return response
+
+
+def stream_iterator_response(chunks: Iterator[bytes], filename: str) -> StreamingHttpResponse:
+    """
+    Create a response that streams the bytes produced by the iterator as an attachment.
+    Used for content generated on the fly, whose length is not known up front.
+    :param chunks: iterator over the content of the file
+    :param filename: name of the file presented to the client
+    :return: StreamingHttpResponse streaming the content
+    """
+    response = StreamingHttpResponse(chunks, content_type='application/force-download')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+
+async def iterate_in_thread(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Produce the chunks of the iterator without blocking the event loop. Every chunk is read in a worker thread
+    that is released as soon as the chunk is read, so a slow client holds its connection open, not a thread.
+    The iterator is closed when the response is finished or the client disconnects.
+    :param chunks: iterator reading the content from the disk
+    :return: asynchronous iterator over the same chunks
+    """
+    try:
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            await asyncio.to_thread(chunks.close)
+
+
+def serve_streaming(request: WSGIRequest, response: HttpResponse) -> HttpResponse:
+    """
+    Stream the body of the response asynchronously if the request is served by ASGI.
+    Under ASGI, Django would otherwise read a synchronous body into memory before sending it. Under WSGI
+    the response is returned unchanged, the server iterates it in the worker thread handling the request.
+    :param request: WSGIRequest or ASGIRequest object containing metadata about the request
+    :param response: response to serve
+    :return: the same response
+    """
+    if isinstance(request, ASGIRequest) and response.streaming and not response.is_async:
+        response.streaming_content = iterate_in_thread(iter(response.streaming_content))
+    return response
+
+
+def format_etag(etag: str, weak: bool = False) -> str:
+    """
+    Quote the entity tag for the ETag header.
+    :param etag: unquoted entity tag of the resource
+    :param weak: whether the tag is weak, e.g. for content that is produced anew with different bytes
+    :return: string containing the quoted entity tag
+    """
+    return f'W/{quote_etag(etag)}' if weak else quote_etag(etag)
+
+
+def conditional_response(request: WSGIRequest, etag: str, last_modified: datetime,
+                         weak: bool = False) -> HttpResponse | None:
+    """
+    Evaluate the If-None-Match, If-Modified-Since, If-Match and If-Unmodified-Since headers of the request.
+    A weak entity tag never matches If-Match, which requires the exact bytes.
+    :param request: WSGIRequest object containing metadata about the request
+    :param etag: unquoted entity tag of the resource
+    :param last_modified: aware datetime of the last modification of the resource
+    :param weak: whether the entity tag is weak
+    :return: 304 or 412 response if the request is conditional and the condition applies, None otherwise
+    """
+    response = get_conditional_response(request, etag=format_etag(etag, weak),
+                                        last_modified=int(last_modified.timestamp()))
+    if response is not None:
+        set_validators(response, etag, last_modified, weak)
+    return response
+
+
+def set_validators(response: HttpResponse, etag: str, last_modified: datetime, weak: bool = False) -> HttpResponse:
+    """
+    Set the ETag and Last-Modified headers of the response.
+    :param response: response to set the headers on
+    :param etag: unquoted entity tag of the resource
+    :param last_modified: aware datetime of the last modification of the resource
+    :param weak: whether the entity tag is weak
+    :return: the same response
+    """
+    response['ETag'] = format_etag(etag, weak)
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def parse_range_header(header: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Parse the value of the Range header into a list of inclusive byte ranges.
+    Overlapping and adjacent ranges are merged. Unsatisfiable ranges are dropped.
+    :param header: value of the Range header, e.g. 'bytes=0-499,1000-'
+    :param size: size of the resource in bytes
+    :return: list of (start, end) tuples, empty list if no range is satisfiable,
+             None if the header is malformed and should be ignored
+    """
+    unit, _, range_set = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not range_set:
+        return None
+
+    ranges = []
+    for range_spec in range_set.split(','):
+        match = RANGE_RE.match(range_spec)
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first == '':
+            suffix_length = int(last)
+            # A suffix of an empty file is unsatisfiable, it has no last bytes to send
+            if suffix_length == 0 or size == 0:
+                continue
+            start, end = max(size - suffix_length, 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+        ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES_PER_REQUEST:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def read_range(content: BinaryIO, start: int, end: int) -> Iterator[bytes]:
+    """
+    Read the inclusive byte range of the file in chunks of FILE_STREAM_BLOCK_SIZE bytes.
+    :param content: opened file object
+    :param start: first byte of the range
+    :param end: last byte of the range
+    :return: iterator over the chunks of the range
+    """
+    content.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = content.read(min(FILE_STREAM_BLOCK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def stream_ranges(content: BinaryIO, parts: list[tuple[bytes, int, int]], closing: bytes) -> Iterator[bytes]:
+    """
+    Stream the given parts of the file and close it afterward.
+    :param content: opened file object
+    :param parts: list of (header, start, end) tuples, header is sent before each range
+    :param closing: bytes sent after the last range
+    :return: iterator over the response body
+    """
+    try:
+        for header, start, end in parts:
+            if header:
+                yield header
+            yield from read_range(content, start, end)
+        if closing:
+            yield closing
+    finally:
+        content.close()
+
+
+def ranged_file_response(request: WSGIRequest, content: BinaryIO, filename: str, size: int,
+                         etag: str, last_modified: datetime) -> HttpResponse:
+    """
+    Create a download response for the file honouring conditional and Range requests.
+    Returns 304/412 for matching conditional requests, 206 with a single range or a multipart/byteranges body
+    for satisfiable Range requests, 416 for unsatisfiable ones and 200 with the whole file otherwise.
+    The file is always streamed in chunks and closed when the response is.
+    :param request: WSGIRequest object containing metadata about the request
+    :param content: opened file object
+    :param filename: name of the file presented to the client
+    :param size: size of the file in bytes
+    :param etag: unquoted entity tag of the file
+    :param last_modified: aware datetime of the last modification of the file
+    :return: HttpResponse
+    """
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        content.close()
+        return not_modified
+
+    ranges = None
+    range_header = request.headers.get('Range')
+    if range_header and if_range_matches(request.headers.get('If-Range'), etag, last_modified):
+        ranges = parse_range_header(range_header, size)
+
+    if ranges is None:
+        response = stream_file_response(content, filename)
+    elif not ranges:
+        content.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(stream_ranges(content, [(b'', start, end)], b''), status=206,
+                                         content_type='application/force-download')
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [(f'\r\n--{boundary}\r\n'
+                  f'Content-Type: application/force-download\r\n'
+                  f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'.encode(), start, end)
+                 for start, end in ranges]
+        closing = f'\r\n--{boundary}--\r\n'.encode()
+        response = StreamingHttpResponse(stream_ranges(content, parts, closing), status=206,
+                                         content_type=f'multipart/byteranges; boundary={boundary}')
+        response['Content-Length'] = (sum(len(header) + end - start + 1 for header, start, end in parts)
+                                      + len(closing))
+
+    if response.status_code == 206:
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'bytes'
+    return set_validators(response, etag, last_modified)
+
+
+def if_range_matches(if_range: str | None, etag: str, last_modified: datetime) -> bool:
+    """
+    Check whether the If-Range precondition allows a partial response.
+    :param if_range: value of the If-Range header, None if not present
+    :param etag: unquoted entity tag of the resource
+    :param last_modified: aware datetime of the last modification of the resource
+    :return: True if the Range header should be honoured, False if the whole resource should be sent
+    """
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == quote_etag(etag)
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and if_range_date >= int(last_modified.timestamp())
@@ -0,0 +1,66 @@
+import hashlib
+import mimetypes
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+# Leading bytes of common formats, checked before falling back to the extension of the file
+MAGIC_NUMBERS = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (b'Rar!\x1a\x07', 'application/vnd.rar'),
+    (b'BZh', 'application/x-bzip2'),
+    (b'\xfd7zXZ\x00', 'application/x-xz'),
+    (b'OggS', 'audio/ogg'),
+    (b'ID3', 'audio/mpeg'),
+    (b'fLaC', 'audio/flac'),
+    (b'\x7fELF', 'application/x-executable'),
+    (b'MZ', 'application/vnd.microsoft.portable-executable'),
+]
+
+
+def sniff_mime_type(head: bytes, filename: str) -> str:
+    """
+    Detect the MIME type of a file from its first bytes, falling back to its extension.
+    :param head: first bytes of the file
+    :param filename: name of the file
+    :return: string containing the MIME type, 'application/octet-stream' if it is unknown
+    """
+    for magic_number, mime_type in MAGIC_NUMBERS:
+        if head.startswith(magic_number):
+            return mime_type
+    if head[4:8] == b'ftyp':
+        return 'video/mp4'
+    if head.startswith(b'RIFF') and head[8:12] in (b'WEBP', b'WAVE', b'AVI '):
+        return {b'WEBP': 'image/webp', b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo'}[head[8:12]]
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Upload handler that streams the uploaded file to a temporary file and inspects it on the way.
+    The SHA-256 and the MIME type sniffed from the first chunk are available as the 'sha256'
+    and 'mime_type' attributes of the uploaded file, no second read of the file is needed.
+    """
+
+    def new_file(self, *args, **kwargs) -> None:
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.mime_type = None
+
+    def receive_data_chunk(self, raw_data: bytes, start: int) -> None:
+        if self.mime_type is None:
+            self.mime_type = sniff_mime_type(raw_data, self.file_name)
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size: int) -> TemporaryUploadedFile:
+        uploaded_file = super().file_complete(file_size)
+        uploaded_file.sha256 = self.sha256.hexdigest()
+        uploaded_file.mime_type = self.mime_type or sniff_mime_type(b'', self.file_name)
+        return uploaded_file
@@ -0,0 +1,74 @@
+from django.db.models import F, Q
+from Server.models.usage_model import UserUsage
+from Server.settings import DEFAULT_USER_QUOTA
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when an upload does not fit into the storage quota of the user.
+    """
+
+
+def get_quota(usage: UserUsage) -> int | None:
+    """
+    Get the quota of the user in bytes.
+    :param usage: UserUsage object of the user
+    :return: quota in bytes, None if the storage of the user is unlimited
+    """
+    return usage.quota if usage.quota is not None else DEFAULT_USER_QUOTA
+
+
+def get_usage(user_id: int) -> UserUsage:
+    """
+    Get the usage counters of the user, created empty for users without files.
+    :param user_id: primary key of the user
+    :return: UserUsage object
+    """
+    return UserUsage.objects.get_or_create(user_id=user_id)[0]
+
+
+def adjust_usage(user_id: int, live_bytes: int = 0, live_files: int = 0, bin_bytes: int = 0,
+                 bin_files: int = 0) -> None:
+    """
+    Add the given amounts to the usage counters of the user with a single update.
+    Must be called in the transaction the files are changed in.
+    :param user_id: primary key of the user
+    :return: None
+    """
+    UserUsage.objects.filter(user_id=user_id).update(live_bytes=F('live_bytes') + live_bytes,
+                                                     live_files=F('live_files') + live_files,
+                                                     bin_bytes=F('bin_bytes') + bin_bytes,
+                                                     bin_files=F('bin_files') + bin_files)
+
+
+def charge_upload(user_id: int, size: int) -> None:
+    """
+    Count an uploaded file towards the usage of the user if it fits into the quota.
+    The check and the increment are one conditional update, concurrent uploads cannot both pass
+    the check and together exceed the quota. Must be called in the transaction the File is created in.
+    :param user_id: primary key of the user
+    :param size: size of the file in bytes
+    :return: None
+    """
+    get_usage(user_id)
+    fits_quota = Q(quota__isnull=False, quota__gte=F('live_bytes') + F('bin_bytes') + size)
+    if DEFAULT_USER_QUOTA is None:
+        fits_quota |= Q(quota__isnull=True)
+    else:
+        fits_quota |= Q(quota__isnull=True, live_bytes__lte=DEFAULT_USER_QUOTA - size - F('bin_bytes'))
+    if not UserUsage.objects.filter(fits_quota, user_id=user_id).update(live_bytes=F('live_bytes') + size,
+                                                                         live_files=F('live_files') + 1):
+        raise QuotaExceeded('Storage quota exceeded')
+
+
+def check_quota(user_id: int, size: int) -> bool:
+    """
+    Check whether a file of the given size currently fits into the quota of the user, e.g. before a resumable
+    upload is started. The quota is enforced again when the file is stored.
+    :param user_id: primary key of the user
+    :param size: size of the file in bytes
+    :return: True if the file fits
+    """
+    usage = get_usage(user_id)
+    quota = get_quota(usage)
+    return quota is None or usage.live_bytes + usage.bin_bytes + size <= quota
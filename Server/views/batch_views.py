@@ -0,0 +1,235 @@
+# batch_views.py
+import functools
+import json
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from Server.utils.archive_cache import invalidate_archives
+from Server.utils.blob_store import purge_blobs, release_in_bulk
+from Server.utils.decorators import response_logger
+from Server.utils.file_cleaner import removal_executor
+from Server.utils.listing_cache import record_changes
+from Server.utils.usage import adjust_usage
+from Server.models.file_model import File
+from Server.models.share_model import Share
+from Server.settings import BATCH_MAX_SIZE
+
+
+class BatchError(ValueError):
+    """
+    Raised when the body of a batch request is invalid.
+    """
+
+
+def parse_batch(request: WSGIRequest) -> dict:
+    """
+    Parse the JSON body of a batch request. The body must contain a list of file access tokens under 'tokens'.
+    Duplicate tokens are dropped, the order of the remaining ones is kept.
+    :param request: WSGIRequest object containing the batch in its body
+    :return: dictionary with the body of the request
+    """
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        raise BatchError('Invalid JSON body')
+    tokens = body.get('tokens') if isinstance(body, dict) else None
+    if not isinstance(tokens, list) or not all(isinstance(token, str) for token in tokens):
+        raise BatchError('A list of file tokens is expected under "tokens"')
+    if len(tokens) > BATCH_MAX_SIZE:
+        raise BatchError(f'At most {BATCH_MAX_SIZE} files can be changed at once')
+    body['tokens'] = list(dict.fromkeys(tokens))
+    return body
+
+
+def get_owned_files(request: WSGIRequest, tokens: list[str], action: str) -> tuple[dict, dict]:
+    """
+    Look up the files with the given tokens in one query and check that they belong to the user.
+    The files are locked until the transaction ends, so they cannot be changed by concurrent requests
+    between the checks and the changes of the batch.
+    :param request: WSGIRequest object containing metadata about the request
+    :param tokens: access tokens of the files
+    :param action: name of the action used in the error messages, e.g. 'delete'
+    :return: Tuple containing the results of the tokens that failed the checks
+             and a dictionary of (primary key, deleted_at, size) of the owned files by their tokens
+    """
+    results = {}
+    owned_files = {}
+    files = File.objects.select_for_update().filter(access_token__in=tokens) \
+        .values_list('access_token', 'pk', 'user_id', 'deleted_at', 'size')
+    found = {access_token: (pk, user_id, deleted_at, size) for access_token, pk, user_id, deleted_at, size in files}
+    for token in tokens:
+        if token not in found:
+            results[token] = error_result(token, 'File not found', 404)
+        elif found[token][1] != request.user.pk:
+            results[token] = error_result(token, f'User not authorized to {action} the file', 403)
+        else:
+            owned_files[token] = (found[token][0], found[token][2], found[token][3] or 0)
+    return results, owned_files
+
+
+def error_result(token: str, error: str, status: int) -> dict:
+    return {'file_token': token, 'error': error, 'status': status}
+
+
+def success_result(token: str, message: str) -> dict:
+    return {'file_token': token, 'message': message, 'status': 200}
+
+
+def batch_response(tokens: list[str], results: dict) -> JsonResponse:
+    """
+    Create the response of a batch request with one result per token, in the order of the request.
+    """
+    return JsonResponse({'results': [results[token] for token in tokens]})
+
+
+def batch_view(action: str):
+    """
+    Decorator for batch views. It checks that the user is authenticated and parses the body of the request,
+    the decorated view receives the parsed body. The files are looked up and changed in one transaction.
+    :param action: name of the action used in the error messages
+    :return: decorator
+    """
+    def decorator(func: callable) -> callable:
+        @functools.wraps(func)
+        def wrapper(request: WSGIRequest) -> JsonResponse:
+            if not request.user.is_authenticated:
+                return JsonResponse({'error': 'User not authenticated'}, status=401)
+            try:
+                batch = parse_batch(request)
+            except BatchError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            with transaction.atomic():
+                results, owned_files = get_owned_files(request, batch['tokens'], action)
+                return func(request, batch, results, owned_files)
+        return wrapper
+    return decorator
+
+
+@require_http_methods(["PUT"])
+@csrf_exempt
+@response_logger
+@batch_view('delete')
+def put_files_in_bin(request: WSGIRequest, batch: dict, results: dict, owned_files: dict) -> JsonResponse:
+    """
+    Put the files with the given tokens in the bin. Their shares are removed.
+    All files are changed with one update and one delete in a single transaction.
+    :param request: WSGIRequest object containing a JSON body with the list of file tokens under 'tokens'
+    :return: JsonResponse containing the result for every token
+    """
+    file_ids = []
+    moved_tokens = []
+    moved_bytes = 0
+    for token, (pk, deleted_at, size) in owned_files.items():
+        if deleted_at:
+            results[token] = error_result(token, 'File already in trash', 400)
+        else:
+            file_ids.append(pk)
+            moved_tokens.append(token)
+            moved_bytes += size
+            results[token] = success_result(token, 'File moved to trash')
+
+    with release_in_bulk():
+        Share.objects.filter(file_id__in=file_ids).delete()
+    File.objects.filter(pk__in=file_ids).update(deleted_at=timezone.now())
+    adjust_usage(request.user.pk, live_bytes=-moved_bytes, live_files=-len(file_ids),
+                 bin_bytes=moved_bytes, bin_files=len(file_ids))
+    record_changes((request.user.pk, listing, token) for token in moved_tokens for listing in ('files', 'bin'))
+
+    def invalidate_moved_archives() -> None:
+        for file_id in file_ids:
+            invalidate_archives(file_id)
+
+    transaction.on_commit(invalidate_moved_archives)
+    return batch_response(batch['tokens'], results)
+
+
+@require_http_methods(["PUT"])
+@csrf_exempt
+@response_logger
+@batch_view('recover')
+def recover_files(request: WSGIRequest, batch: dict, results: dict, owned_files: dict) -> JsonResponse:
+    """
+    Recover the files with the given tokens from the bin with a single update in one transaction with the usage.
+    :param request: WSGIRequest object containing a JSON body with the list of file tokens under 'tokens'
+    :return: JsonResponse containing the result for every token
+    """
+    file_ids = []
+    moved_tokens = []
+    moved_bytes = 0
+    for token, (pk, deleted_at, size) in owned_files.items():
+        if not deleted_at:
+            results[token] = error_result(token, 'File not in trash', 400)
+        else:
+            file_ids.append(pk)
+            moved_tokens.append(token)
+            moved_bytes += size
+            results[token] = success_result(token, 'File restored')
+
+    File.objects.filter(pk__in=file_ids).update(deleted_at=None)
+    adjust_usage(request.user.pk, live_bytes=moved_bytes, live_files=len(file_ids),
+                 bin_bytes=-moved_bytes, bin_files=-len(file_ids))
+    record_changes((request.user.pk, listing, token) for token in moved_tokens for listing in ('files', 'bin'))
+    return batch_response(batch['tokens'], results)
+
+
+@require_http_methods(["DELETE"])
+@csrf_exempt
+@response_logger
+@batch_view('delete')
+def delete_files(request: WSGIRequest, batch: dict, results: dict, owned_files: dict) -> JsonResponse:
+    """
+    Permanently delete the files with the given tokens in a single transaction.
+    References to blobs and usage are released in bulk, blobs no other file references are purged with their
+    content in the same transaction, as the file cleaner does.
+    Content of legacy files is removed once the transaction commits.
+    :param request: WSGIRequest object containing a JSON body with the list of file tokens under 'tokens'
+    :return: JsonResponse containing the result for every token
+    """
+    with release_in_bulk() as released:
+        File.objects.filter(pk__in=[pk for pk, _, _ in owned_files.values()]).delete()
+    purge_blobs(released.blob_counts, removal_executor)
+    transaction.on_commit(lambda: default_storage.delete_many(released.names, removal_executor))
+    for token in owned_files:
+        results[token] = success_result(token, 'File deleted')
+    return batch_response(batch['tokens'], results)
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@response_logger
+@batch_view('share')
+def share_files(request: WSGIRequest, batch: dict, results: dict, owned_files: dict) -> JsonResponse:
+    """
+    Share the files with the given tokens with the user whose username is given under 'username'.
+    Files already shared with the user are reported, the others are shared with a single insert.
+    :param request: WSGIRequest object containing a JSON body with the list of file tokens under 'tokens'
+                    and the username under 'username'
+    :return: JsonResponse containing the result for every token
+    """
+    username = batch.get('username')
+    if username == request.user.username:
+        return JsonResponse({'error': 'Cannot share file with yourself'}, status=400)
+    try:
+        shared_with = User.objects.get(username=username)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'User not found'}, status=404)
+
+    file_ids = {pk: token for token, (pk, _, _) in owned_files.items()}
+    already_shared = set(Share.objects.filter(file_id__in=file_ids, shared_with=shared_with)
+                         .values_list('file_id', flat=True))
+    new_shares = []
+    for pk, token in file_ids.items():
+        if pk in already_shared:
+            results[token] = error_result(token, 'File already shared with the user', 400)
+        else:
+            new_shares.append(Share(file_id=pk, shared_with=shared_with, shared_by=request.user))
+            results[token] = success_result(token, 'File shared successfully')
+
+    Share.objects.bulk_create(new_shares, ignore_conflicts=True)
+    record_changes((shared_with.pk, 'shared', file_ids[share.file_id]) for share in new_shares)
+    return batch_response(batch['tokens'], results)
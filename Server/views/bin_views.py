@@ -1,9 +1,14 @@
 from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
 from django.http import JsonResponse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from Server.utils.blob_store import release_in_bulk
 from Server.utils.decorators import response_logger
+from Server.utils.usage import adjust_usage
+from Server.utils.listing_cache import cached_listing
+from Server.utils.listings import BIN_COLUMNS, FILE_SORT_KEYS, ListingError, aget_listing_page, get_bin_entry
 from Server.models.file_model import File
 from Server.models.share_model import Share
 
@@ -11,23 +16,24 @@ from Server.models.share_model import Share
 @require_http_methods(["GET"])
 @csrf_exempt
 @response_logger
-def get_files_in_bin(request: WSGIRequest) -> JsonResponse:
+@cached_listing('bin')
+async def get_files_in_bin(request: WSGIRequest) -> JsonResponse:
     """
     Get the list of files in the bin. Files in bin are those that have been deleted by the user.
     The JSON response will contain a list of dictionaries with the keys 'file_token' and 'filename'.
+    The listing can be sorted, filtered and paginated with the 'sort', 'prefix', 'limit' and 'cursor'
+    query parameters, the cursor of the next page is returned as 'next_cursor'.
     :param request: WSGIRequest object containing metadata about the request
     :return: JsonResponse
     """
-    user = request.user
+    user = await request.auser()
     if user.is_authenticated:
-        files = File.objects.filter(user=user, deleted_at__isnull=False)
-        if not files:
-            return JsonResponse({'files': []})
-        return JsonResponse(
-            {'files': [{'file_token': file.access_token,
-                        'filename': file.get_original_filename(),
-                        'file_size': file.file.size}
-                       for file in files]})
+        try:
+            files, next_cursor = await aget_listing_page(File.objects.filter(user=user, deleted_at__isnull=False),
+                                                         request.GET, FILE_SORT_KEYS, 'filename', BIN_COLUMNS)
+        except ListingError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse({'files': [get_bin_entry(*row) for row in files], 'next_cursor': next_cursor})
     else:
         return JsonResponse({'error': 'User not authenticated'}, status=401)
 
@@ -38,25 +44,28 @@ def get_files_in_bin(request: WSGIRequest) -> JsonResponse:
 def put_file_in_bin(request: WSGIRequest, access_token: str) -> JsonResponse:
     """
     Put the file with the given file_id in the bin.
+    The file is locked while it is checked and moved, so concurrent requests move it and count it only once.
     :param request: WSGIRequest object containing metadata about the request
     :param access_token: The access token of the file
     :return: JsonResponse containing the result of the deletion
     """
     try:
         if request.user.is_authenticated:
-            file = File.objects.get(access_token=access_token)
-            if file.user != request.user:
-                return JsonResponse({'error': 'User not authorized to delete the file'}, status=403)
+            with transaction.atomic():
+                file = File.objects.select_for_update().get(access_token=access_token)
+                if file.user_id != request.user.pk:
+                    return JsonResponse({'error': 'User not authorized to delete the file'}, status=403)
 
-            if file.deleted_at:
-                return JsonResponse({'error': 'File already in trash'}, status=400)
+                if file.deleted_at:
+                    return JsonResponse({'error': 'File already in trash'}, status=400)
 
-            shares = Share.objects.filter(file=file)
-            for share in shares:
-                share.delete()
+                with release_in_bulk():
+                    Share.objects.filter(file=file).delete()
 
-            file.deleted_at = timezone.now()
-            file.save()
+                file.deleted_at = timezone.now()
+                file.save()
+                adjust_usage(file.user_id, live_bytes=-(file.size or 0), live_files=-1,
+                             bin_bytes=file.size or 0, bin_files=1)
 
             return JsonResponse({'message': 'File moved to trash'})
         else:
@@ -71,21 +80,25 @@ def put_file_in_bin(request: WSGIRequest, access_token: str) -> JsonResponse:
 def recover_file(request: WSGIRequest, access_token: str):
     """
     Recover the file with the given file_id from the bin.
+    The file is locked while it is checked and restored, so concurrent requests restore it and count it only once.
     :param request: WSGIRequest object containing metadata about the request
     :param access_token: The access token of the file
     :return: JsonResponse containing the result of the recovery
     """
     try:
         if request.user.is_authenticated:
-            file = File.objects.get(access_token=access_token)
-            if file.user != request.user:
-                return JsonResponse({'error': 'User not authorized to recover the file'}, status=403)
+            with transaction.atomic():
+                file = File.objects.select_for_update().get(access_token=access_token)
+                if file.user_id != request.user.pk:
+                    return JsonResponse({'error': 'User not authorized to recover the file'}, status=403)
 
-            if not file.deleted_at:
-                return JsonResponse({'error': 'File not in trash'}, status=400)
+                if not file.deleted_at:
+                    return JsonResponse({'error': 'File not in trash'}, status=400)
 
-            file.deleted_at = None
-            file.save()
+                file.deleted_at = None
+                file.save()
+                adjust_usage(file.user_id, live_bytes=file.size or 0, live_files=1,
+                             bin_bytes=-(file.size or 0), bin_files=-1)
 
             return JsonResponse({'message': 'File restored'})
         else:
@@ -1,32 +1,45 @@
 # file_views.py
-import os
+import asyncio
+from asgiref.sync import sync_to_async
 from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from Server.utils.decorators import response_logger
-from Server.utils.file_operations import encrypt_file, get_file_from_path, \
-    generate_unique_access_token, create_tarfile_in_memory
+from Server.utils.file_operations import encrypt_file, open_stored_file, \
+    generate_unique_access_token, stream_archive
+from Server.utils.responses import conditional_response, ranged_file_response, serve_streaming, set_validators, \
+    stream_file_response, stream_iterator_response
+from Server.utils.archive_cache import cache_archive, open_cached_archive
+from Server.utils.blob_store import store_file
+from Server.utils.usage import QuotaExceeded
+from Server.utils.listing_cache import cached_listing
+from Server.utils.listings import FILE_COLUMNS, FILE_SORT_KEYS, ListingError, aget_listing_page, get_file_entry, \
+    get_listed_filename
 from Server.models.file_model import File
-from Server.settings import MAX_FILE_SIZE
+from Server.settings import MAX_FILE_SIZE, ARCHIVE_COMPRESSION_LEVEL
+
+ARCHIVE_EXTENSIONS = {'tar': '.tar', 'zip': '.zip'}
 
 
 @require_http_methods(["GET", "POST", "DELETE"])
 @csrf_exempt
 @response_logger
-def file_view(request: WSGIRequest, access_token: str = None) -> HttpResponse:
+async def file_view(request: WSGIRequest, access_token: str = None) -> HttpResponse:
     """
     View for file operations. The operations supported are GET, POST, and DELETE.
+    Downloads are served asynchronously, uploads and deletions run in a thread.
     :param request: WSGIRequest object containing metadata about the request
     :param access_token: The access token of the file
     :return: HttpResponse
     """
     if request.method == 'GET':
-        return get_file(request, access_token)
+        return await get_file(request, access_token)
     elif request.method == 'POST' and access_token is None:
-        return upload_file(request)
+        return await sync_to_async(upload_file)(request)
     elif request.method == 'DELETE':
-        return delete_file(request, access_token)
+        return await sync_to_async(delete_file)(request, access_token)
     else:
         return JsonResponse({'error': 'Method not allowed'}, status=405)
 
@@ -34,30 +47,48 @@ def file_view(request: WSGIRequest, access_token: str = None) -> HttpResponse:
 @require_http_methods(["GET"])
 @csrf_exempt
 @response_logger
-def get_file(request: WSGIRequest, access_token: str) -> HttpResponse:
+async def get_file(request: WSGIRequest, access_token: str) -> HttpResponse:
     """
     Get the download link for the file with the given file_id. The file is downloaded if it exists.
+    The file is looked up with the async ORM and opened and read in worker threads. Under ASGI the content
+    is streamed without holding a thread while the client is slow to receive it.
     :param request: WSGIRequest object containing metadata about the request
     :param access_token: The access token of the file
     :return: JsonResponse containing the file content if the file exists, otherwise an error message
     """
     try:
-        uploaded_file = File.objects.get(access_token=access_token)
+        uploaded_file = await File.objects.aget(access_token=access_token)
         if uploaded_file.deleted_at:
             return JsonResponse({'error': 'File has been removed'}, status=404)
 
         if uploaded_file.password:
-            path, content = get_file_from_path(uploaded_file.file.path)
-            encrypted_file, encrypted_file_path = encrypt_file(uploaded_file.file.path, uploaded_file.password)
-            response = HttpResponse(encrypted_file, content_type='application/force-download')
-            response['Content-Disposition'] = 'attachment; filename=' + path + '.zip'
-            os.remove(encrypted_file_path)
-            return response
+            # Weak, the archive is encrypted anew with different bytes whenever it is not cached
+            etag = uploaded_file.get_etag() + '-zip'
+            not_modified = conditional_response(request, etag, uploaded_file.uploaded_at, weak=True)
+            if not_modified is not None:
+                return not_modified
+
+            filename = uploaded_file.get_original_filename() + '.zip'
+            cached_archive = await asyncio.to_thread(open_cached_archive, uploaded_file, uploaded_file.password)
+            if cached_archive is not None:
+                response = stream_file_response(cached_archive, filename)
+                return serve_streaming(request, set_validators(response, etag, uploaded_file.uploaded_at, weak=True))
+
+            encrypted_file = await asyncio.to_thread(encrypt_file, uploaded_file.file.name,
+                                                     uploaded_file.get_original_filename(), uploaded_file.password)
+            if encrypted_file is None:
+                return JsonResponse({'error': 'File not found'}, status=404)
+            encrypted_file = cache_archive(uploaded_file, uploaded_file.password, encrypted_file)
+            response = stream_iterator_response(encrypted_file, filename)
+            return serve_streaming(request, set_validators(response, etag, uploaded_file.uploaded_at, weak=True))
         else:
-            path, content = get_file_from_path(uploaded_file.file.path)
-            response = HttpResponse(content, content_type='application/force-download')
-            response['Content-Disposition'] = 'attachment; filename=' + path
-            return response
+            content = await asyncio.to_thread(open_stored_file, uploaded_file.file.name)
+            if content is None:
+                return JsonResponse({'error': 'File not found'}, status=404)
+            response = ranged_file_response(request, content, uploaded_file.get_original_filename(),
+                                            content.size,
+                                            uploaded_file.get_etag(), uploaded_file.uploaded_at)
+            return serve_streaming(request, response)
 
     except File.DoesNotExist:
         return JsonResponse({'error': 'File not found'}, status=404)
@@ -69,6 +100,8 @@ def get_file(request: WSGIRequest, access_token: str) -> HttpResponse:
 def upload_file(request: WSGIRequest) -> JsonResponse:
     """
     Upload a file to the server. The file is stored in the 'file' key of the request.
+    The content is hashed while it is received and stored only once, identical uploads share one blob.
+    Size, SHA-256 and MIME type of the file are recorded in the same pass.
     :param request: WSGIRequest object containing metadata about the request and the file to upload
     :return: JsonResponse containing the URL to download the file
     """
@@ -78,10 +111,13 @@ def upload_file(request: WSGIRequest) -> JsonResponse:
     if file_obj.size > MAX_FILE_SIZE:
         return JsonResponse({'error': 'File size exceeds 1GB'}, status=400)
 
-    uploaded_file = File.objects.create(file=request.FILES['file'],
-                                        access_token=generate_unique_access_token(),
-                                        password=password,
-                                        user=user)
+    try:
+        uploaded_file = store_file(file_obj, file_obj.sha256, file_obj.mime_type,
+                                   access_token=generate_unique_access_token(),
+                                   password=password,
+                                   user=user)
+    except QuotaExceeded as e:
+        return JsonResponse({'error': str(e)}, status=413)
 
     return JsonResponse({'url': f'/file/{uploaded_file.access_token}/'})
 
@@ -92,14 +128,17 @@ def upload_file(request: WSGIRequest) -> JsonResponse:
 def delete_file(request: WSGIRequest, access_token: str) -> JsonResponse:
     """
     Delete the file with the given file_id. The file is permanently deleted.
+    Its content is removed from the disk once no other file references the same blob.
+    The file is locked while it is deleted, so a concurrent move to or from the bin cannot change
+    which usage counters it is released from.
     :param request: WSGIRequest object containing metadata about the request
     :param access_token: The access token of the file
     :return: JsonResponse containing the result of the deletion
     """
     try:
-        file = File.objects.get(access_token=access_token)
-        os.remove(file.file.path)
-        file.delete()
+        with transaction.atomic():
+            file = File.objects.select_for_update().get(access_token=access_token)
+            file.delete()
         return JsonResponse({'message': 'File deleted'})
     except File.DoesNotExist:
         return JsonResponse({'error': 'File not found'}, status=404)
@@ -108,24 +147,25 @@ def delete_file(request: WSGIRequest, access_token: str) -> JsonResponse:
 @require_http_methods(["GET"])
 @csrf_exempt
 @response_logger
-def get_user_filenames(request: WSGIRequest) -> JsonResponse:
+@cached_listing('files')
+async def get_user_filenames(request: WSGIRequest) -> JsonResponse:
     """
     Get the list of files uploaded by the user.
     The JSON response will contain a list of dictionaries with the keys 'file_token' and 'filename'.
     Using the 'file_token' key, the user can reference the file.
+    The listing can be sorted, filtered and paginated with the 'sort', 'prefix', 'limit' and 'cursor'
+    query parameters, the cursor of the next page is returned as 'next_cursor'.
     :param request: WSGIRequest object containing metadata about the request
     :return: JsonResponse
     """
-    user = request.user
+    user = await request.auser()
     if user.is_authenticated:
-        files = File.objects.filter(user=user, deleted_at=None)
-        response = []
-        for file in files:
-            try:
-                response.append({'file_token': file.access_token, 'filename': file.get_original_filename()})
-            except FileNotFoundError:
-                file.delete()
-        return JsonResponse({'files': response})
+        try:
+            files, next_cursor = await aget_listing_page(File.objects.filter(user=user, deleted_at=None), request.GET,
+                                                         FILE_SORT_KEYS, 'filename', FILE_COLUMNS)
+        except ListingError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse({'files': [get_file_entry(*row) for row in files], 'next_cursor': next_cursor})
     else:
         return JsonResponse({'error': 'User not authenticated'}, status=401)
 
@@ -133,20 +173,32 @@ def get_user_filenames(request: WSGIRequest) -> JsonResponse:
 @require_http_methods(["GET"])
 @csrf_exempt
 @response_logger
-def get_user_files(request: WSGIRequest) -> HttpResponse:
+async def get_user_files(request: WSGIRequest) -> HttpResponse:
     """
-    Get the list of files uploaded by the user.
-    The JSON response will contain a list of dictionaries with the keys 'url' and 'filename'.
-    Using the 'url' key, the user can download the file.
+    Download all files uploaded by the user as a single archive. The archive is streamed while the files are read.
+    The 'format' query parameter selects 'tar' (default) or 'zip'. The 'compression' query parameter selects
+    the compression level from 0 to 9, 'store' is an alias of 0 and is best for files that are already compressed.
+    Tar archives are gzipped unless the level is 0.
     :param request: WSGIRequest object containing metadata about the request
-    :return: JsonResponse
+    :return: StreamingHttpResponse with the archive, JsonResponse with an error message otherwise
     """
-    user = request.user
+    user = await request.auser()
     if user.is_authenticated:
-        files = File.objects.filter(user=user)
+        archive_format = request.GET.get('format', 'tar')
+        compression = request.GET.get('compression', str(ARCHIVE_COMPRESSION_LEVEL))
+        compression_level = 0 if compression == 'store' else int(compression) if compression.isdigit() else -1
+        if archive_format not in ARCHIVE_EXTENSIONS or not 0 <= compression_level <= 9:
+            return JsonResponse({'error': 'Invalid archive format or compression level'}, status=400)
+
+        files = [row async for row in File.objects.filter(user=user).values_list('file', 'filename')]
         if not files:
             return JsonResponse({'error': 'No files uploaded'}, status=404)
-        tar_data = create_tarfile_in_memory([file.file.path for file in files])
-        return HttpResponse(tar_data, content_type='application/force-download')
+        archive = stream_archive([(name, get_listed_filename(name, filename))
+                                  for name, filename in files],
+                                 archive_format, compression_level)
+        extension = ARCHIVE_EXTENSIONS[archive_format]
+        if archive_format == 'tar' and compression_level:
+            extension += '.gz'
+        return serve_streaming(request, stream_iterator_response(archive, f'{user.username}_files{extension}'))
     else:
         return JsonResponse({'error': 'User not authenticated'}, status=401)
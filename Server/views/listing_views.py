@@ -0,0 +1,176 @@
+# listing_views.py
+import asyncio
+import json
+from django.core.handlers.asgi import ASGIRequest
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from Server.utils.decorators import response_logger
+from Server.utils.event_bus import event_bus
+from Server.utils.listing_cache import LISTINGS, aget_listing_version
+from Server.utils.listings import BIN_COLUMNS, FILE_COLUMNS, SHARE_COLUMNS, get_bin_entry, get_file_entry, \
+    get_share_entry
+from Server.models.file_model import File
+from Server.models.listing_change_model import ListingChange
+from Server.models.share_model import Share
+from Server.settings import EVENT_STREAM_HEARTBEAT, LISTING_MAX_PAGE_SIZE
+
+
+async def aget_current_entries(user, listing: str, tokens: set[str]) -> dict[str, dict]:
+    """
+    Get the current entries of the files with the given tokens that are in the listing of the user.
+    :param user: User whose listing is read
+    :param listing: name of the listing, one of LISTINGS
+    :param tokens: access tokens of the files
+    :return: dictionary mapping the tokens of the files still in the listing to their entries
+    """
+    if listing == 'files':
+        rows = File.objects.filter(user=user, deleted_at=None, access_token__in=tokens).values_list(*FILE_COLUMNS)
+        get_entry = get_file_entry
+    elif listing == 'bin':
+        rows = File.objects.filter(user=user, deleted_at__isnull=False, access_token__in=tokens) \
+            .values_list(*BIN_COLUMNS)
+        get_entry = get_bin_entry
+    else:
+        rows = Share.objects.filter(shared_with=user, file__access_token__in=tokens).values_list(*SHARE_COLUMNS)
+        get_entry = get_share_entry
+    return {row[0]: get_entry(*row) async for row in rows}
+
+
+async def aget_listing_changes(user, since: int) -> dict:
+    """
+    Get the changes of the listings of the user since the given version.
+    For every listing, 'files', 'bin' and 'shared', the current entries of the changed files are returned,
+    files no longer in the listing are returned as {'file_token': ..., 'removed': True}.
+    At most LISTING_MAX_PAGE_SIZE changes are returned at once, 'more' is true if the client should ask again
+    with the returned version. If changes since the given version were already pruned, 'reset' is true and
+    the client has to reload the listings.
+    :param user: User whose listings are read
+    :param since: version of the listings the client has
+    :return: dictionary containing the version, the changed entries per listing, 'more' and 'reset'
+    """
+    version = await aget_listing_version(user.pk)
+    if since >= version:
+        return {'version': version, 'changes': {listing: [] for listing in LISTINGS}, 'more': False, 'reset': False}
+
+    oldest = await ListingChange.objects.order_by('pk').values_list('pk', flat=True).afirst()
+    if oldest is not None and since + 1 < oldest:
+        return {'version': version, 'changes': {listing: [] for listing in LISTINGS}, 'more': False, 'reset': True}
+
+    changes = [change async for change in ListingChange.objects.filter(user_id=user.pk, pk__gt=since)
+               .order_by('pk').values_list('pk', 'listing', 'access_token')[:LISTING_MAX_PAGE_SIZE + 1]]
+    more = len(changes) > LISTING_MAX_PAGE_SIZE
+    changes = changes[:LISTING_MAX_PAGE_SIZE]
+    changed_tokens = {listing: {} for listing in LISTINGS}
+    for _, listing, access_token in changes:
+        # Tokens are kept in the order they last changed in, repeated changes of a file are returned once
+        changed_tokens[listing].pop(access_token, None)
+        changed_tokens[listing][access_token] = None
+
+    entries_by_listing = {}
+    for listing, tokens in changed_tokens.items():
+        entries = await aget_current_entries(user, listing, set(tokens)) if tokens else {}
+        entries_by_listing[listing] = [entries.get(access_token, {'file_token': access_token, 'removed': True})
+                                       for access_token in tokens]
+    if more:
+        version = changes[-1][0]
+    elif changes:
+        version = max(version, changes[-1][0])
+    return {'version': version, 'changes': entries_by_listing, 'more': more, 'reset': False}
+
+
+def format_event(event: str, data: dict, event_id: int = None) -> str:
+    """
+    Format a Server-Sent Event.
+    :param event: name of the event
+    :param data: JSON serializable data of the event
+    :param event_id: id of the event, sent back by reconnecting clients in the 'Last-Event-ID' header
+    :return: string containing the event
+    """
+    lines = [f'event: {event}', f'data: {json.dumps(data, separators=(",", ":"))}']
+    if event_id is not None:
+        lines.insert(0, f'id: {event_id}')
+    return '\n'.join(lines) + '\n\n'
+
+
+@require_http_methods(["GET"])
+@csrf_exempt
+@response_logger
+async def get_listing_changes(request: WSGIRequest) -> JsonResponse:
+    """
+    Get the changes of the listings of the user since the version given in the 'since' query parameter,
+    the version a client got in the 'Listing-Version' header of a listing or from this view, see
+    aget_listing_changes.
+    :param request: WSGIRequest object containing metadata about the request
+    :return: JsonResponse containing the version, the changed entries per listing, 'more' and 'reset'
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'User not authenticated'}, status=401)
+    try:
+        since = int(request.GET.get('since', ''))
+    except ValueError:
+        return JsonResponse({'error': "Query parameter 'since' must be a listing version"}, status=400)
+    return JsonResponse(await aget_listing_changes(user, since))
+
+
+@require_http_methods(["GET"])
+@csrf_exempt
+@response_logger
+async def stream_listing_changes(request: WSGIRequest) -> StreamingHttpResponse | JsonResponse:
+    """
+    Stream the changes of the listings of the user as Server-Sent Events, instead of polling the listings.
+    Every 'changes' event contains the same data as the response of get_listing_changes and has
+    the version as its id. The stream starts at the version given in the 'since' query parameter or
+    in the 'Last-Event-ID' header of a reconnecting client, otherwise at the current version, which is sent
+    in a 'version' event. A 'reset' event asks the client to reload the listings.
+    Changes are pushed as soon as their transaction commits in this process, changes made by other processes
+    are noticed with the next heartbeat, every EVENT_STREAM_HEARTBEAT seconds.
+    Requires the ASGI server, a streaming WSGI worker would be blocked for as long as the client is connected.
+    :param request: WSGIRequest object containing metadata about the request
+    :return: StreamingHttpResponse with the events
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Event streams are only served by the ASGI server'}, status=501)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'User not authenticated'}, status=401)
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return JsonResponse({'error': "Query parameter 'since' must be a listing version"}, status=400)
+
+    async def events():
+        nonlocal since
+        # Subscribed once the response is streamed, a response that is never sent leaves no subscription behind.
+        # Subscribed before the version is read, so no change committed in between is missed.
+        subscription = event_bus.subscribe(user.pk)
+        try:
+            yield f'retry: {EVENT_STREAM_HEARTBEAT * 1000}\n\n'
+            if since is None:
+                since = await aget_listing_version(user.pk)
+                yield format_event('version', {'version': since}, since)
+            while True:
+                changes = await aget_listing_changes(user, since)
+                if changes['reset']:
+                    yield format_event('reset', {'version': changes['version']}, changes['version'])
+                elif any(changes['changes'].values()):
+                    yield format_event('changes', changes, changes['version'])
+                since = changes['version']
+                if changes['more']:
+                    continue
+                try:
+                    await asyncio.wait_for(subscription.get(), EVENT_STREAM_HEARTBEAT)
+                    # Events published together are answered with one query
+                    subscription.get_pending()
+                except TimeoutError:
+                    yield ': heartbeat\n\n'
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,23 @@
+# metrics_views.py
+import hmac
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
+from Server.utils.metrics import registry
+from Server.settings import METRICS_TOKEN
+
+
+@require_http_methods(["GET"])
+def get_metrics(request: WSGIRequest) -> JsonResponse:
+    """
+    Get the request metrics of this process: per endpoint and method the number of requests, the counts
+    of the status codes, a cumulative latency histogram in milliseconds and the bytes sent.
+    Available to staff users and to clients sending the METRICS_TOKEN as a bearer token.
+    :param request: WSGIRequest object containing metadata about the request
+    :return: JsonResponse containing the metrics
+    """
+    authorization = request.headers.get('Authorization', '')
+    has_token = bool(METRICS_TOKEN) and hmac.compare_digest(authorization, f'Bearer {METRICS_TOKEN}')
+    if not has_token and not request.user.is_staff:
+        return JsonResponse({'error': 'User not authorized to read the metrics'}, status=403)
+    return JsonResponse(registry.snapshot())
@@ -1,10 +1,15 @@
 # share_views.py
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
 from django.core.handlers.wsgi import WSGIRequest
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from Server.utils.blob_store import release_in_bulk
 from Server.utils.decorators import response_logger
+from Server.utils.listing_cache import cached_listing
+from Server.utils.listings import SHARE_COLUMNS, SHARE_SORT_KEYS, ListingError, aget_listing_page, get_share_entry
 from Server.models.file_model import File
 from Server.models.share_model import Share
 
@@ -12,22 +17,23 @@ from Server.models.share_model import Share
 @require_http_methods(["GET", "POST", "DELETE"])
 @csrf_exempt
 @response_logger
-def share_view(request: WSGIRequest, access_token: str = None, shared_with: str = None) -> JsonResponse:
+async def share_view(request: WSGIRequest, access_token: str = None, shared_with: str = None) -> JsonResponse:
     """
     View for sharing files. It handles sharing, getting shared files and deleting shares.
+    The listing is served asynchronously, changes of shares run in a thread.
     :param request: WSGIRequest object containing metadata about the request
     :param access_token: unique access token of the file
     :param shared_with: username of the user with whom the file is shared
     :return: JsonResponse
     """
     if request.method == 'POST' and access_token is not None and shared_with is not None:
-        return share_file(request, access_token, shared_with)
+        return await sync_to_async(share_file)(request, access_token, shared_with)
     elif request.method == 'GET' and access_token is None and shared_with is None:
-        return get_shared_files(request)
+        return await get_shared_files(request)
     elif request.method == 'DELETE' and access_token is not None and shared_with is not None:
-        return delete_share(request, access_token, shared_with)
+        return await sync_to_async(delete_share)(request, access_token, shared_with)
     elif request.method == 'DELETE' and access_token is not None and shared_with is None:
-        return delete_all_shares_of_file(request, access_token)
+        return await sync_to_async(delete_all_shares_of_file)(request, access_token)
     else:
         return JsonResponse({'error': 'Method not allowed'}, status=405)
 
@@ -38,7 +44,8 @@ def share_view(request: WSGIRequest, access_token: str = None, shared_with: str
 def share_file(request: WSGIRequest, access_token: str, username: str) -> JsonResponse:
     """
     Share a file with the given access token with the user with the given username.
-    It creates a Share object with the file and the user.
+    It creates a Share object with the file and the user. Duplicate shares are rejected by the unique
+    constraint on the file and the user, so no separate lookup is needed.
     :param request: WSGIRequest object containing metadata about the request
     :param access_token: unique access token of the file
     :param username: username of the user with whom the file is shared
@@ -53,17 +60,17 @@ def share_file(request: WSGIRequest, access_token: str, username: str) -> JsonRe
             if file.user.username == username:
                 return JsonResponse({'error': 'Cannot share file with yourself'}, status=400)
 
-            if User.objects.filter(username=username).count() == 0:
-                return JsonResponse({'error': 'User not found'}, status=404)
-
-            if Share.objects.filter(file=file, shared_with=User.objects.get(username=username)).exists():
-                return JsonResponse({'error': 'File already shared with the user'}, status=400)
-
             shared_with = User.objects.get(username=username)
-            Share.objects.create(file=file, shared_with=shared_with, shared_by=request.user)
+            try:
+                with transaction.atomic():
+                    Share.objects.create(file=file, shared_with=shared_with, shared_by=request.user)
+            except IntegrityError:
+                return JsonResponse({'error': 'File already shared with the user'}, status=400)
             return JsonResponse({'message': 'File shared successfully'})
         except File.DoesNotExist:
             return JsonResponse({'error': 'File not found'}, status=404)
+        except User.DoesNotExist:
+            return JsonResponse({'error': 'User not found'}, status=404)
     else:
         return JsonResponse({'error': 'User not authenticated'}, status=401)
 
@@ -71,22 +78,27 @@ def share_file(request: WSGIRequest, access_token: str, username: str) -> JsonRe
 @require_http_methods(["GET"])
 @csrf_exempt
 @response_logger
-def get_shared_files(request: WSGIRequest) -> JsonResponse:
+@cached_listing('shared')
+async def get_shared_files(request: WSGIRequest) -> JsonResponse:
     """
     Get the list of files shared with the user.
     The JSON response will contain a list of dictionaries with the keys 'file_token' and 'filename'.
     Using the 'file_token' key, the user can reference the file.
     User must be authenticated to access this view. If not, it returns an error.
+    The listing can be sorted, filtered and paginated with the 'sort', 'prefix', 'limit' and 'cursor'
+    query parameters, the cursor of the next page is returned as 'next_cursor'.
+    Responses are cached until the files shared with the user change, see cached_listing.
     :param request: WSGIRequest object containing metadata about the request
     :return: JsonResponse containing the list of shared files
     """
-    if request.user.is_authenticated:
-        shared_files = Share.objects.filter(shared_with=request.user)
-        return JsonResponse({'files': [{'file_token': file.file.access_token,
-                                        'filename': file.file.get_original_filename(),
-                                        'file_size': file.file.file.size,
-                                        'owner': file.shared_by.username
-                                        } for file in shared_files]})
+    user = await request.auser()
+    if user.is_authenticated:
+        try:
+            shared_files, next_cursor = await aget_listing_page(
+                Share.objects.filter(shared_with=user), request.GET, SHARE_SORT_KEYS, 'file__filename', SHARE_COLUMNS)
+        except ListingError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse({'files': [get_share_entry(*row) for row in shared_files], 'next_cursor': next_cursor})
     else:
         return JsonResponse({'error': 'User not authenticated'}, status=401)
 
@@ -135,9 +147,8 @@ def delete_all_shares_of_file(request: WSGIRequest, access_token: str) -> JsonRe
             file = File.objects.get(access_token=access_token)
             if file.user != request.user:
                 return JsonResponse({'error': 'User not authorized to delete the shares'}, status=403)
-            shares = Share.objects.filter(file=file)
-            for share in shares:
-                share.delete()
+            with transaction.atomic(), release_in_bulk():
+                Share.objects.filter(file=file).delete()
             return JsonResponse({'message': 'Shares deleted successfully'})
         except File.DoesNotExist:
             return JsonResponse({'error': 'File not found'}, status=404)
@@ -0,0 +1,175 @@
+# upload_views.py
+import os
+import uuid
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from Server.utils.decorators import response_logger
+from Server.utils.chunked_upload import AssembledUploadFile, create_partial_file, get_partial_path, \
+    remove_partial_file, stage_chunk, write_chunk
+from Server.utils.blob_store import inspect_file, staged_blob, store_file
+from Server.utils.file_operations import generate_unique_access_token
+from Server.utils.usage import QuotaExceeded, check_quota
+from Server.models.upload_model import UploadSession
+from Server.settings import MAX_FILE_SIZE, CHUNKED_UPLOAD_MAX_CHUNK_SIZE
+
+
+@require_http_methods(["GET", "POST", "PUT", "DELETE"])
+@csrf_exempt
+@response_logger
+def upload_view(request: WSGIRequest, upload_id: str = None) -> JsonResponse:
+    """
+    View for resumable uploads. A POST without upload id initiates an upload, PUT sends a chunk,
+    GET returns the progress and DELETE aborts the upload.
+    :param request: WSGIRequest object containing metadata about the request
+    :param upload_id: id of the upload session
+    :return: JsonResponse
+    """
+    if request.method == 'POST' and upload_id is None:
+        return initiate_upload(request)
+    elif upload_id is None:
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        upload = UploadSession.objects.get(upload_id=upload_id)
+    except UploadSession.DoesNotExist:
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+    if upload.user is not None and upload.user != request.user:
+        return JsonResponse({'error': 'User not authorized to access the upload'}, status=403)
+
+    if request.method == 'PUT':
+        return upload_chunk(request, upload)
+    elif request.method == 'GET':
+        return get_upload_progress(request, upload)
+    elif request.method == 'DELETE':
+        return abort_upload(request, upload)
+    else:
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
+def initiate_upload(request: WSGIRequest) -> JsonResponse:
+    """
+    Initiate a resumable upload. In the body of the request, the 'filename' and the total 'size' in bytes
+    are expected. The optional password is read from the 'password' header, as for regular uploads.
+    Uploads that would not fit into the storage quota of the user are rejected up front.
+    :param request: WSGIRequest object containing metadata about the request
+    :return: JsonResponse containing the upload id and the offset of the next chunk
+    """
+    filename = os.path.basename(request.POST.get('filename', ''))
+    size = request.POST.get('size', '')
+    if not filename or not size.isdigit():
+        return JsonResponse({'error': 'Filename and size are required'}, status=400)
+    if int(size) > MAX_FILE_SIZE:
+        return JsonResponse({'error': 'File size exceeds 1GB'}, status=400)
+    if request.user.is_authenticated and not check_quota(request.user.pk, int(size)):
+        return JsonResponse({'error': 'Storage quota exceeded'}, status=413)
+
+    upload = UploadSession.objects.create(upload_id=uuid.uuid4().hex,
+                                          filename=filename,
+                                          size=int(size),
+                                          password=request.headers.get('password', None),
+                                          user=request.user if request.user.is_authenticated else None)
+    create_partial_file(upload.upload_id)
+    return JsonResponse({'upload_id': upload.upload_id, 'offset': 0})
+
+
+def upload_chunk(request: WSGIRequest, upload: UploadSession) -> JsonResponse:
+    """
+    Append the body of the request to the upload. The 'Upload-Offset' header must be equal to the number
+    of bytes received so far, otherwise the current offset is returned with status 409 and the client should resume
+    from there. The body is staged on the disk as it is read from the connection. The offset is claimed only then,
+    in the transaction the chunk is written into the upload in, so a retried chunk cannot interleave its writes
+    with a chunk still being received and a completion never sees a chunk half written.
+    :param request: WSGIRequest object containing the chunk in its body
+    :param upload: UploadSession the chunk belongs to
+    :return: JsonResponse containing the offset of the next chunk
+    """
+    offset = request.headers.get('Upload-Offset', '')
+    length = request.META.get('CONTENT_LENGTH') or '0'
+    if not offset.isdigit() or not length.isdigit():
+        return JsonResponse({'error': 'Upload-Offset and Content-Length headers are required'}, status=400)
+    offset, length = int(offset), int(length)
+
+    if offset != upload.received:
+        return JsonResponse({'error': 'Chunk does not start at the current offset', 'offset': upload.received},
+                            status=409)
+    if length > CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        return JsonResponse({'error': 'Chunk too large'}, status=413)
+    if offset + length > upload.size:
+        return JsonResponse({'error': 'Chunk exceeds the declared file size'}, status=400)
+
+    chunk_file, length = stage_chunk(request, length)
+    with chunk_file:
+        with transaction.atomic():
+            claimed = UploadSession.objects.filter(pk=upload.pk, received=offset).update(received=offset + length)
+            if claimed:
+                write_chunk(upload.upload_id, offset, chunk_file)
+    if not claimed:
+        upload.refresh_from_db()
+        return JsonResponse({'error': 'Concurrent chunk upload', 'offset': upload.received}, status=409)
+    return JsonResponse({'offset': offset + length})
+
+
+def get_upload_progress(request: WSGIRequest, upload: UploadSession) -> JsonResponse:
+    """
+    Get the progress of the upload.
+    :param request: WSGIRequest object containing metadata about the request
+    :param upload: UploadSession to report on
+    :return: JsonResponse containing the filename, the total size and the offset of the next chunk
+    """
+    return JsonResponse({'upload_id': upload.upload_id, 'filename': upload.filename,
+                         'size': upload.size, 'offset': upload.received})
+
+
+def abort_upload(request: WSGIRequest, upload: UploadSession) -> JsonResponse:
+    """
+    Abort the upload and remove the chunks received so far.
+    :param request: WSGIRequest object containing metadata about the request
+    :param upload: UploadSession to abort
+    :return: JsonResponse containing the result of the operation
+    """
+    remove_partial_file(upload.upload_id)
+    upload.delete()
+    return JsonResponse({'message': 'Upload aborted'})
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@response_logger
+def complete_upload(request: WSGIRequest, upload_id: str) -> JsonResponse:
+    """
+    Finalize the upload once all chunks were received. The assembled file is hashed in one read and linked
+    into the blob storage, not copied, unless a blob with the same content exists already. A File is created for it.
+    The session is claimed by deleting it in the transaction the File is created in, so of concurrent completions
+    of the same upload only one creates a File. The session is kept if the File cannot be stored.
+    :param request: WSGIRequest object containing metadata about the request
+    :param upload_id: id of the upload session
+    :return: JsonResponse containing the URL to download the file
+    """
+    try:
+        upload = UploadSession.objects.get(upload_id=upload_id)
+    except UploadSession.DoesNotExist:
+        return JsonResponse({'error': 'Upload not found'}, status=404)
+    if upload.user is not None and upload.user != request.user:
+        return JsonResponse({'error': 'User not authorized to access the upload'}, status=403)
+    if upload.received != upload.size:
+        return JsonResponse({'error': 'Upload incomplete', 'offset': upload.received}, status=400)
+
+    partial_path = get_partial_path(upload.upload_id)
+    with AssembledUploadFile(partial_path, upload.filename) as assembled_file:
+        # The content is hashed and staged before the transaction, the database is not locked while it is read
+        sha256, mime_type = inspect_file(assembled_file, upload.filename)
+        try:
+            with staged_blob(assembled_file, sha256) as content, transaction.atomic():
+                if not UploadSession.objects.filter(pk=upload.pk, received=upload.size).delete()[0]:
+                    return JsonResponse({'error': 'Upload not found'}, status=404)
+                uploaded_file = store_file(content, sha256, mime_type,
+                                           access_token=generate_unique_access_token(),
+                                           password=upload.password,
+                                           user=upload.user)
+        except QuotaExceeded as e:
+            return JsonResponse({'error': str(e)}, status=413)
+    remove_partial_file(upload.upload_id)
+    return JsonResponse({'url': f'/file/{uploaded_file.access_token}/'})
@@ -0,0 +1,32 @@
+# usage_views.py
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from Server.utils.decorators import response_logger
+from Server.utils.usage import get_quota, get_usage
+
+
+@require_http_methods(["GET"])
+@csrf_exempt
+@response_logger
+def get_user_usage(request: WSGIRequest) -> JsonResponse:
+    """
+    Get the storage used by the files of the user, read from the usage counters without summing up the files.
+    Files in the bin are reported separately and count towards the quota.
+    :param request: WSGIRequest object containing metadata about the request
+    :return: JsonResponse containing the bytes and number of files, the quota and the bytes still available,
+             quota and available are null if the storage of the user is unlimited
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'User not authenticated'}, status=401)
+    usage = get_usage(request.user.pk)
+    quota = get_quota(usage)
+    used_bytes = usage.live_bytes + usage.bin_bytes
+    return JsonResponse({'live_bytes': usage.live_bytes,
+                         'live_files': usage.live_files,
+                         'bin_bytes': usage.bin_bytes,
+                         'bin_files': usage.bin_files,
+                         'used_bytes': used_bytes,
+                         'quota': quota,
+                         'available_bytes': max(quota - used_bytes, 0) if quota is not None else None})